@@ -1,18 +1,28 @@
+import asyncio
+import hmac
+import orjson
+import secrets
+import threading
 import time
-import uuid
+from anyio import from_thread
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
-from typing import Optional, Annotated, Dict, Any
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Optional, Annotated, Dict, Any, AsyncIterator, List, Sequence, Tuple
 
 from src.api.schemas import (
     ChatCompletionRequest,
     ChatCompletionResponse,
+    ChatCompletionChunk,
     ResponseMessage,
+    DeltaMessage,
     Choice,
+    ChunkChoice,
     Usage
 )
-from src.orchestration.agent_manager import MasterOrchestrator, OrchestrationError
-from src.execution.trino_client import get_trino_executor, TrinoExecutor
-from src.caching.cache import get_cache_client, RedisCache
+from src.orchestration.agent_manager import MasterOrchestrator, OrchestrationError, OrchestrationResult
+from src.caching.cache import get_cache_client, intent_signature, orjson_default, RedisCache
+from src.caching.semantic import get_semantic_index, SemanticNLQIndex
 from src.config import settings
 from src.logging.logger import get_logger
 
@@ -21,23 +31,21 @@ router = APIRouter()
 
 # --- Dependency Injection ---
 
-def get_orchestrator(
-    trino: TrinoExecutor = Depends(get_trino_executor),
-    cache: Optional[RedisCache] = Depends(get_cache_client)
-) -> MasterOrchestrator:
-    """Dependency injector for the MasterOrchestrator."""
-    # Potentially cache the orchestrator instance if initialization is expensive,
-    # but ensure thread safety if it holds state.
-    return MasterOrchestrator(trino_executor=trino, cache_client=cache)
+def get_orchestrator(request: Request) -> MasterOrchestrator:
+    """Dependency injector for the shared MasterOrchestrator created at startup."""
+    return request.app.state.orchestrator
 
 # --- Authentication (Placeholder) ---
 
+# Read once at import; settings are immutable for the life of the process
+_API_KEY = settings.API_KEY.encode()
+
 async def verify_api_key(x_api_key: Annotated[str | None, Header()] = None):
     """Placeholder for API Key authentication."""
-    if settings.API_KEY and x_api_key == settings.API_KEY:
+    # Constant-time comparison, so response timing doesn't leak how much of the key matched
+    if _API_KEY and x_api_key and hmac.compare_digest(x_api_key.encode(), _API_KEY):
         return True
-    # In a real app, use a more secure comparison (e.g., timing-attack resistant)
-    # and proper key management.
+    # In a real app, use proper key management.
     logger.warning("API Key verification failed.")
     raise HTTPException(status_code=401, detail="Invalid API Key")
 
@@ -50,36 +58,46 @@ async def verify_api_key(x_api_key: Annotated[str | None, Header()] = None):
 )
 async def chat_completions(
     request: ChatCompletionRequest,
-    orchestrator: MasterOrchestrator = Depends(get_orchestrator)
+    orchestrator: MasterOrchestrator = Depends(get_orchestrator),
+    cache: Optional[RedisCache] = Depends(get_cache_client),
+    semantic_index: Optional[SemanticNLQIndex] = Depends(get_semantic_index)
 ):
     """
     Handles NLQ requests, orchestrates SQL generation and execution,
     and returns results in an OpenAI-compatible format.
     """
-    request_id = f"chatcmpl-{uuid.uuid4()}"
+    request_id = f"chatcmpl-{secrets.token_hex(16)}" # 128 random bits, no UUID object/formatting
     created_time = int(time.time())
 
-    # Extract the last user message as the NLQ
-    # TODO: Handle conversation history if needed for multi-turn queries
-    last_user_message = next((msg for msg in reversed(request.messages) if msg.role == 'user'), None)
-
-    if not last_user_message or not last_user_message.content:
-        logger.error("No user message found in the request.")
-        raise HTTPException(status_code=400, detail="No user message provided.")
+    # The last user message is the NLQ; its presence is enforced by ChatCompletionRequest
+    nlq = request.last_user_message.content
+    logger.info("Received NLQ request (ID: %s): '%.100s...'", request_id, nlq)
 
-    nlq = last_user_message.content
-    logger.info(f"Received NLQ request (ID: {request_id}): '{nlq[:100]}...'")
+    if request.stream:
+        return StreamingResponse(
+            stream_chat_completion(orchestrator, nlq, request_id, created_time, request.model),
+            media_type="text/event-stream"
+        )
 
     try:
-        # Run the orchestration process
-        orchestration_result = await run_orchestration_async(orchestrator, nlq)
+        # Serve paraphrased repeats from the NLQ cache before touching the agents or Trino
+        nlq_sig = intent_signature(nlq)
+        cached_result, nlq_embedding = await get_cached_result(nlq, nlq_sig, cache, semantic_index)
+        if cached_result is not None:
+            logger.info("Serving request %s from NLQ cache.", request_id)
+            orchestration_result = OrchestrationResult(status="SUCCESS", nlq=nlq, **cached_result)
+        else:
+            # Run the orchestration process
+            orchestration_result = await run_orchestration_async(orchestrator, nlq)
+            if cache and orchestration_result.status == "SUCCESS":
+                await cache_result(nlq, nlq_sig, orchestration_result, cache, semantic_index, nlq_embedding)
 
         # Format the response based on the orchestration outcome
         response_content = format_response_content(orchestration_result)
-        finish_reason = "stop" if orchestration_result.get("status") == "SUCCESS" else "error"
+        finish_reason = "stop" if orchestration_result.status == "SUCCESS" else "error"
 
-        if orchestration_result.get("status") != "SUCCESS" and not response_content:
-             response_content = f"Processing failed. Error: {orchestration_result.get('error_message', 'Unknown error')}"
+        if orchestration_result.status != "SUCCESS" and not response_content:
+             response_content = f"Processing failed. Error: {orchestration_result.error_message or 'Unknown error'}"
 
 
         response_message = ResponseMessage(content=response_content)
@@ -88,67 +106,214 @@ async def chat_completions(
         # TODO: Implement token counting if needed for Usage field
         usage_data = Usage()
 
-        return ChatCompletionResponse(
+        response = ChatCompletionResponse(
             id=request_id,
             created=created_time,
             model=request.model, # Echo back requested model
             choices=[choice],
             usage=usage_data
             # Add custom fields here if needed (e.g., _sql_query)
-            # _sql_query=orchestration_result.get("sql_final")
+            # _sql_query=orchestration_result.sql_final
         )
+        # Returned as a Response so FastAPI doesn't re-validate the model against
+        # response_model (kept for the OpenAPI schema); orjson encodes the dump.
+        return ORJSONResponse(content=response.model_dump())
 
     except HTTPException:
         # Re-raise HTTPExceptions (like auth errors)
         raise
     except OrchestrationError as e:
-        logger.error(f"Orchestration failed for request {request_id}: {e}")
+        logger.error("Orchestration failed for request %s: %s", request_id, e)
         raise HTTPException(status_code=500, detail=f"Orchestration Error: {e}")
     except Exception as e:
-        logger.exception(f"Unexpected error processing request {request_id}: {e}")
+        logger.exception("Unexpected error processing request %s: %s", request_id, e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {type(e).__name__}")
 
 
-async def run_orchestration_async(orchestrator: MasterOrchestrator, nlq: str) -> Dict[str, Any]:
+async def get_cached_result(
+    nlq: str,
+    nlq_sig: str,
+    cache: Optional[RedisCache],
+    semantic_index: Optional[SemanticNLQIndex]
+) -> Tuple[Optional[Dict[str, Any]], Optional[Any]]:
+    """
+    Looks up a cached orchestration result by exact intent signature, then (if enabled)
+    by embedding similarity to previously answered NLQs.
+    Returns (cached result or None, the NLQ's embedding if the semantic lookup computed one),
+    so a miss can be indexed by `cache_result` without embedding the NLQ again.
+    """
+    if not cache:
+        return None, None
+    cached_result = await cache.get(f"nlq:{nlq_sig}")
+    nlq_embedding = None
+    if not isinstance(cached_result, dict) and semantic_index:
+        try:
+            similar_sig, nlq_embedding = await semantic_index.lookup(nlq)
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+            similar_sig = None
+        if similar_sig:
+            cached_result = await cache.get(f"nlq:{similar_sig}")
+    # Entries without column names predate them and can't be rendered faithfully
+    return (cached_result if isinstance(cached_result, dict) and "columns" in cached_result else None), nlq_embedding
+
+
+async def cache_result(
+    nlq: str,
+    nlq_sig: str,
+    result: OrchestrationResult,
+    cache: RedisCache,
+    semantic_index: Optional[SemanticNLQIndex],
+    nlq_embedding: Optional[Any] = None
+):
+    """
+    Stores a successful orchestration result under its intent signature and indexes the NLQ,
+    reusing `nlq_embedding` from `get_cached_result` when there is one.
+    """
+    await cache.set(f"nlq:{nlq_sig}", {
+        "sql_final": result.sql_final,
+        "results": result.results,
+        "columns": result.columns,
+        "results_truncated": result.results_truncated,
+        "explanation": result.explanation,
+    }, ttl=settings.NLQ_CACHE_TTL)
+    if semantic_index:
+        try:
+            await semantic_index.add(nlq, nlq_sig, nlq_embedding)
+        except Exception as e:
+            logger.warning("Semantic cache indexing failed: %s", e)
+
+
+async def run_orchestration_async(orchestrator: MasterOrchestrator, nlq: str) -> OrchestrationResult:
+    """
+    Runs the orchestration on the event loop. MasterOrchestrator is async end to end:
+    Redis calls are awaited directly, and blocking Trino and LLM calls are pushed to
+    worker threads inside it, so many NLQs are multiplexed on one loop.
+
+    Route handlers stay `async def`; any remaining sync call that touches Trino, Redis
+    or an LLM from them must go through `run_in_threadpool` (see stream_chat_completion).
+    """
+    return await orchestrator.process_nlq(nlq)
+
+
+async def stream_chat_completion(
+    orchestrator: MasterOrchestrator,
+    nlq: str,
+    request_id: str,
+    created_time: int,
+    model: str
+) -> AsyncIterator[str]:
+    """
+    Yields OpenAI `chat.completion.chunk` SSE frames: the explanation, then the SQL,
+    then result rows batch by batch as Trino returns them.
+    Rows are fetched in a worker thread and handed over through a bounded asyncio.Queue.
+    """
+    def frame(content: Optional[str] = None, role: Optional[str] = None, finish_reason: Optional[str] = None) -> str:
+        chunk = ChatCompletionChunk(
+            id=request_id,
+            created=created_time,
+            model=model,
+            choices=[ChunkChoice(delta=DeltaMessage(role=role, content=content), finish_reason=finish_reason)]
+        )
+        return f"data: {chunk.model_dump_json()}\n\n"
+
+    yield frame(role="assistant")
+
+    try:
+        result = await orchestrator.plan_nlq(nlq)
+    except Exception as e:
+        logger.exception("Unexpected error processing request %s: %s", request_id, e)
+        result = OrchestrationResult(nlq=nlq, error_message=f"Unexpected server error: {type(e).__name__}")
+
+    if result.status != "VALIDATED":
+        yield frame(content=format_response_content(result))
+        yield frame(finish_reason="error")
+        yield "data: [DONE]\n\n"
+        return
+
+    if result.explanation:
+        yield frame(content=f"Explanation:\n{result.explanation}\n\n")
+    yield frame(content=f"Generated SQL:\n```sql\n{result.sql_final}\n```\n\nResults:\n")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.STREAM_QUEUE_BATCHES)
+    stop = threading.Event()
+
+    def produce_rows():
+        # Runs in a threadpool worker; queue.put blocks it while the client lags behind
+        try:
+            for columns, batch in orchestrator.trino.stream_query(result.sql_final, settings.STREAM_BATCH_SIZE):
+                if stop.is_set():
+                    break # Closing the generator cancels the Trino query
+                from_thread.run(queue.put, (columns, batch))
+            if not stop.is_set():
+                from_thread.run(queue.put, None)
+        except Exception as e:
+            if not stop.is_set():
+                from_thread.run(queue.put, e)
+
+    producer = asyncio.ensure_future(run_in_threadpool(produce_rows))
+    finish_reason = "stop"
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                logger.error("Streaming execution failed for request %s: %s", request_id, item)
+                yield frame(content=f"\nExecution Failed: Trino Execution Error: {type(item).__name__} - {item}")
+                finish_reason = "error"
+                break
+            columns, batch = item
+            yield frame(content="\n".join(format_row(row, columns) for row in batch) + "\n")
+    finally:
+        # Unblock and stop the producer if the client went away mid-stream
+        stop.set()
+        while not queue.empty():
+            queue.get_nowait()
+
+    await producer
+    # Reached only once the stream ended (a client disconnect exits at a yield above),
+    # so the SQL is cached only if every row came through
+    await orchestrator.record_execution(result, succeeded=finish_reason == "stop")
+    yield frame(finish_reason=finish_reason)
+    yield "data: [DONE]\n\n"
+
+
+def format_row(row: Sequence[Any], columns: List[str]) -> str:
     """
-    Runs the potentially blocking orchestration logic in a thread pool
-    to avoid blocking the main async event loop.
-    FastAPI handles this automatically for standard 'def' route functions,
-    but explicitly using run_in_executor is safer if agents involve I/O.
+    Formats one positional result row for display as a JSON object keyed by the original
+    column names. orjson handles datetimes natively, orjson_default the rest.
     """
-    # For simplicity here, we call it directly. If agent calls are truly blocking I/O,
-    # consider using asyncio.to_thread (Python 3.9+) or starlette.concurrency.run_in_threadpool
-    # loop = asyncio.get_running_loop()
-    # result = await loop.run_in_executor(None, orchestrator.process_nlq, nlq)
-    # return result
-    return orchestrator.process_nlq(nlq) # Assuming agent calls are async or handled internally
+    return orjson.dumps(dict(zip(columns, row)), default=orjson_default).decode()
 
 
-def format_response_content(result: Dict[str, Any]) -> str:
+def format_response_content(result: OrchestrationResult) -> str:
     """
     Formats the final content string for the API response based on success/failure
     and the presence of results, SQL, and explanation.
     """
-    if result.get("status") == "SUCCESS":
+    if result.status == "SUCCESS":
         content_parts = []
-        if result.get("explanation"):
-            content_parts.append(f"Explanation:\n{result.get('explanation')}\n")
-        if result.get("sql_final"):
-             content_parts.append(f"Generated SQL:\n```sql\n{result.get('sql_final')}\n```\n")
-        if result.get("results") is not None:
+        if result.explanation:
+            content_parts.append(f"Explanation:\n{result.explanation}\n")
+        if result.sql_final:
+             content_parts.append(f"Generated SQL:\n```sql\n{result.sql_final}\n```\n")
+        if result.results is not None:
              # TODO: Implement better formatting/summarization for large results
-             results_str = "\n".join(str(row) for row in result["results"][:10]) # Preview first 10 rows
-             if len(result["results"]) > 10:
-                 results_str += f"\n... ({len(result['results'])} total rows)"
+             results_str = "\n".join(format_row(row, result.columns or []) for row in result.results[:10]) # Preview first 10 rows
+             if result.results_truncated:
+                 results_str += f"\n... (more than {len(result.results)} rows, showing the first {min(10, len(result.results))})"
+             elif len(result.results) > 10:
+                 results_str += f"\n... ({len(result.results)} total rows)"
              content_parts.append(f"Results Preview:\n{results_str}")
 
         return "\n".join(content_parts).strip() if content_parts else "Query processed successfully, but no specific output generated."
     else:
         # Failed request
-        error_msg = result.get('error_message', 'An unknown error occurred.')
+        error_msg = result.error_message or 'An unknown error occurred.'
         content = f"Failed to process the query.\nError: {error_msg}"
         # Optionally include the last attempted SQL if available
-        last_sql = result.get('sql_generated') or result.get('sql_final')
+        last_sql = result.sql_generated or result.sql_final
         if last_sql:
             content += f"\n\nLast Attempted SQL:\n```sql\n{last_sql}\n```"
         return content
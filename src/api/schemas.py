@@ -1,20 +1,40 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Literal
+from functools import cached_property
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional, Dict, Any, Literal, Annotated
+from src.config import settings
 
 # --- OpenAI Compatible Schemas ---
 
 class ChatMessage(BaseModel):
     role: Literal["system", "user", "assistant"]
-    content: str
+    # Size limits reject oversized payloads with a 422 before any orchestration work
+    content: str = Field(max_length=settings.MAX_PROMPT_CHARS)
 
 class ChatCompletionRequest(BaseModel):
     model: str # Although we use our own logic, mimic OpenAI structure
-    messages: List[ChatMessage]
-    # Add other OpenAI parameters if needed (temperature, max_tokens, stream, etc.)
-    # stream: bool = False
+    messages: Annotated[List[ChatMessage], Field(max_length=settings.MAX_MESSAGES)]
+    # Add other OpenAI parameters if needed (temperature, max_tokens, etc.)
+    stream: bool = False
     max_tokens: Optional[int] = None
     # ... other potential fields
 
+    @cached_property
+    def last_user_message(self) -> Optional[ChatMessage]:
+        """The last non-empty user message, which carries the NLQ."""
+        # TODO: Handle conversation history if needed for multi-turn queries
+        messages = self.messages
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].role == "user":
+                return messages[i] if messages[i].content else None
+        return None
+
+    @model_validator(mode="after")
+    def require_user_message(self) -> "ChatCompletionRequest":
+        # Rejected here, the request fails with a 422 before the route handler runs
+        if self.last_user_message is None:
+            raise ValueError("No user message provided.")
+        return self
+
 class ResponseMessage(BaseModel):
     role: Literal["assistant"] = "assistant"
     # Content could be SQL, results summary, explanation, or error
@@ -45,6 +65,24 @@ class ChatCompletionResponse(BaseModel):
     # _explanation: Optional[str] = None
     # _results_preview: Optional[List[Dict[str, Any]]] = None
 
+# --- Streaming (stream=true) Schemas ---
+
+class DeltaMessage(BaseModel):
+    role: Optional[Literal["assistant"]] = None
+    content: Optional[str] = None
+
+class ChunkChoice(BaseModel):
+    index: int = 0
+    delta: DeltaMessage
+    finish_reason: Optional[Literal["stop", "length", "error"]] = None
+
+class ChatCompletionChunk(BaseModel):
+    id: str
+    object: Literal["chat.completion.chunk"] = "chat.completion.chunk"
+    created: int
+    model: str
+    choices: List[ChunkChoice]
+
 # --- Internal Schemas (Optional) ---
 
 # Could define Pydantic models for internal state if needed,
@@ -1,82 +1,223 @@
-import redis
-import json
-from typing import Optional, Any
+import hashlib
+import re
+import orjson
+import zstandard
+from typing import Optional, Any, List, Set
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
 from src.config import settings
 from src.logging.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Conversational filler that does not change what data an NLQ asks for. Deliberately
+# short: anything that could be a data term or filter ("us", "like", "return", "show")
+# must stay, or distinct questions would share a cache entry.
+_NLQ_FILLER_WORDS = frozenset({
+    "please", "pls", "kindly", "could", "would", "you", "me", "the",
+})
+# Words in any script (str patterns are Unicode-aware), plus comparison operators
+_NLQ_TOKEN_RE = re.compile(r"[\w.%<>=!-]+", re.UNICODE)
+# Quoted literals ('Smith', "Smith"): Trino compares strings case-sensitively
+_NLQ_QUOTED_RE = re.compile(r"('[^']*'|\"[^\"]*\")")
+
+def _fold_case(nlq: str) -> str:
+    """Lowercases an NLQ outside quoted literals, whose case is significant."""
+    parts = _NLQ_QUOTED_RE.split(nlq)
+    return "".join(part if i % 2 else part.lower() for i, part in enumerate(parts))
+
+def orjson_default(value: Any) -> Any:
+    """Serializes types orjson doesn't handle (e.g. Decimal in result rows) as str."""
+    return str(value)
+
+# Shared (de)compressor for large cached text such as the schema; used from the event loop thread only
+_zstd_compressor = zstandard.ZstdCompressor()
+_zstd_decompressor = zstandard.ZstdDecompressor()
+
+def compress_text(text: str) -> bytes:
+    """zstd-compresses text for caching (stored as raw bytes)."""
+    return _zstd_compressor.compress(text.encode())
+
+def decompress_text(value: bytes) -> Optional[str]:
+    """Reverses `compress_text`. Returns None for values that aren't compressed text (e.g. older entries)."""
+    try:
+        return _zstd_decompressor.decompress(value).decode()
+    except (zstandard.ZstdError, UnicodeDecodeError, TypeError) as e:
+        logger.debug("Cached value is not compressed text: %s", e)
+        return None
+
+def nlq_key(nlq: str) -> str:
+    """
+    Hashes an NLQ with only whitespace normalized. Case is kept: it can matter to the
+    SQL (e.g. a value the NLQ names, quoted or not). Unlike `intent_signature` it never
+    merges different questions, so it is safe to key long-lived or shared results
+    (validated SQL, coalesced runs) on.
+    """
+    return hashlib.blake2b(" ".join(nlq.split()).encode(), digest_size=16).hexdigest()
+
+def intent_signature(nlq: str) -> str:
+    """
+    Computes a cheap intent signature for an NLQ: case, punctuation, whitespace
+    and conversational filler are normalized away so trivially paraphrased
+    repeats ("Could you show me the top 5 customers?" / "show top 5 customers please")
+    share a key. Quoted literals keep their case ("named 'SMITH'" / "named 'Smith'"),
+    but unquoted values are lowercased like any other word, so "named SMITH" and
+    "named Smith" do collide; only use it for short-lived results.
+    """
+    # Sentence-final "." / "!" is punctuation, not part of the word; decimals ("1.5")
+    # and operators ("!=", ">=") never end in either, so they are kept intact
+    words = (t.rstrip(".!") for t in _NLQ_TOKEN_RE.findall(_fold_case(nlq)))
+    tokens = [t for t in words if t and t not in _NLQ_FILLER_WORDS]
+    if not tokens:
+        # Only filler or punctuation: key on the text itself, never on an empty string
+        tokens = _fold_case(nlq).split() or [nlq]
+    return hashlib.blake2b(" ".join(tokens).encode(), digest_size=16).hexdigest()
+
 class RedisCache:
-    """Simple Redis Cache client."""
-    _instance = None
-
-    def __new__(cls, *args, **kwargs):
-        # Singleton pattern for the cache connection
-        if cls._instance is None:
-            logger.info("Initializing Redis connection pool...")
-            try:
-                pool = redis.ConnectionPool(
-                    host=settings.REDIS_HOST,
-                    port=settings.REDIS_PORT,
-                    db=settings.REDIS_DB,
-                    password=settings.REDIS_PASSWORD,
-                    decode_responses=True # Decode responses to strings automatically
-                )
-                cls._instance = super(RedisCache, cls).__new__(cls)
-                cls._instance.client = redis.Redis(connection_pool=pool)
-                # Test connection
-                cls._instance.client.ping()
-                logger.info("Redis connection successful.")
-            except redis.exceptions.ConnectionError as e:
-                logger.error(f"Failed to connect to Redis: {e}")
-                # Depending on requirements, you might want to raise the error
-                # or allow the app to start with caching disabled (more complex).
-                raise e # Fail fast if cache is essential
-        return cls._instance
-
-    def get(self, key: str) -> Optional[Any]:
+    """
+    Simple async Redis cache client backed by a shared connection pool.
+    Responses are not decoded by the client: JSON values come back deserialized,
+    other UTF-8 values as str, and binary values (e.g. compressed text) as bytes.
+    """
+
+    def __init__(self, pool: aioredis.ConnectionPool):
+        self.client = aioredis.Redis(connection_pool=pool)
+
+    async def ping(self) -> bool:
+        """Check the connection to Redis. Raises on connection failure."""
+        return await self.client.ping()
+
+    @staticmethod
+    def _deserialize(value: bytes) -> Any:
+        try:
+            # Attempt to deserialize if it looks like JSON
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            pass
+        try:
+            # Return as plain string if not JSON
+            return value.decode()
+        except UnicodeDecodeError:
+            return value # Binary payload
+
+    async def get(self, key: str) -> Optional[Any]:
         """Get a value from the cache."""
         try:
-            value = self.client.get(key)
+            value = await self.client.get(key)
             if value:
-                logger.debug(f"Cache HIT for key: {key}")
-                try:
-                    # Attempt to deserialize if it looks like JSON
-                    return json.loads(value)
-                except json.JSONDecodeError:
-                    # Return as plain string if not JSON
-                    return value
-            logger.debug(f"Cache MISS for key: {key}")
+                logger.debug("Cache HIT for key: %s", key)
+                return self._deserialize(value)
+            logger.debug("Cache MISS for key: %s", key)
             return None
-        except redis.exceptions.RedisError as e:
-            logger.error(f"Redis GET error for key {key}: {e}")
+        except RedisError as e:
+            logger.error("Redis GET error for key %s: %s", key, e)
             return None # Treat cache errors as misses
 
-    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Get several values in one round trip (MGET). Missing keys come back as None."""
+        if not keys:
+            return []
+        try:
+            values = await self.client.mget(keys)
+            return [self._deserialize(value) if value else None for value in values]
+        except RedisError as e:
+            logger.error("Redis MGET error for %s keys: %s", len(keys), e)
+            return [None] * len(keys)
+
+    async def get_members(self, *keys: str) -> Set[str]:
+        """Get the members of one Redis set, or the union of several, in one round trip (empty if missing)."""
+        try:
+            return {member.decode() for member in await self.client.sunion(keys)}
+        except RedisError as e:
+            logger.error("Redis SUNION error for keys %s: %s", keys, e)
+            return set()
+
+    async def add_member(self, key: str, member: str, ttl: Optional[int] = None):
+        """Add a member to a Redis set and (re)set the set's TTL, in one round trip."""
+        try:
+            effective_ttl = ttl if ttl is not None else settings.SCHEMA_CACHE_TTL
+            async with self.pipeline() as pipe:
+                pipe.sadd(key, member)
+                pipe.expire(key, effective_ttl)
+                await pipe.execute()
+        except RedisError as e:
+            logger.error("Redis SADD error for key %s: %s", key, e)
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None):
         """Set a value in the cache with an optional TTL (in seconds)."""
         try:
-            # Serialize if it's not a simple string/bytes
+            # Serialize if it's not a simple string/bytes.
+            # orjson handles datetimes natively; orjson_default covers Decimal and the like.
             if not isinstance(value, (str, bytes, int, float)):
-                value = json.dumps(value)
+                value = orjson.dumps(value, default=orjson_default).decode()
 
             effective_ttl = ttl if ttl is not None else settings.SCHEMA_CACHE_TTL
-            self.client.set(key, value, ex=effective_ttl)
-            logger.debug(f"Cache SET for key: {key} with TTL: {effective_ttl}s")
-        except redis.exceptions.RedisError as e:
-            logger.error(f"Redis SET error for key {key}: {e}")
+            await self.client.set(key, value, ex=effective_ttl)
+            logger.debug("Cache SET for key: %s with TTL: %ss", key, effective_ttl)
+        except RedisError as e:
+            logger.error("Redis SET error for key %s: %s", key, e)
         except TypeError as e:
-             logger.error(f"Serialization error for key {key}: {e}")
+             logger.error("Serialization error for key %s: %s", key, e)
+
+    async def delete(self, *keys: str):
+        """Delete keys from the cache; missing keys are ignored."""
+        if not keys:
+            return
+        try:
+            await self.client.delete(*keys)
+            logger.debug("Cache DELETE for keys: %s", keys)
+        except RedisError as e:
+            logger.error("Redis DEL error for keys %s: %s", keys, e)
+
+    def pipeline(self):
+        """
+        Returns a non-transactional pipeline on the underlying client, for batching several
+        commands into one round trip: `async with cache.pipeline() as pipe: ...; await pipe.execute()`.
+        Values are sent as-is (str/bytes/numbers); callers handle RedisError.
+        """
+        return self.client.pipeline(transaction=False)
+
+    async def close(self):
+        """Close the client and release its pool connections."""
+        await self.client.aclose()
+
+
+# Global cache instance, created in the app's startup event so the async
+# connection pool is bound to the running event loop.
+cache_client: Optional[RedisCache] = None
 
+async def init_cache_client() -> Optional[RedisCache]:
+    """Creates the global cache client. Leaves it as None if Redis is unreachable."""
+    global cache_client
+    logger.info("Initializing Redis connection pool...")
+    pool = aioredis.ConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        password=settings.REDIS_PASSWORD,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        decode_responses=False # Keep bytes, so compressed values round-trip; RedisCache decodes text
+    )
+    client = RedisCache(pool)
+    try:
+        await client.ping()
+        logger.info("Redis connection successful.")
+        cache_client = client
+    except RedisError as e:
+        logger.error("Failed to connect to Redis, caching disabled: %s", e)
+        await client.close()
+        cache_client = None # Allow the app to run without caching
+    return cache_client
 
-# Global cache instance
-try:
-    cache_client = RedisCache()
-except Exception:
-    logger.error("Failed to initialize Redis cache client on module load.")
-    cache_client = None # Allow import but client will be None if connection failed
+async def close_cache_client():
+    """Closes the global cache client, if any."""
+    global cache_client
+    if cache_client is not None:
+        await cache_client.close()
+        cache_client = None
 
 def get_cache_client() -> Optional[RedisCache]:
     """Dependency function to get the cache client."""
     if cache_client is None:
         logger.warning("Attempting to use cache, but client is not initialized.")
-    return cache_client 
\ No newline at end of file
+    return cache_client
@@ -0,0 +1,134 @@
+import asyncio
+import base64
+from concurrent.futures import Executor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from src.caching.cache import RedisCache
+from src.config import settings
+from src.logging.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Fixed seed so every worker process draws the same hyperplanes and buckets agree
+_LSH_SEED = 0x5EED
+
+
+@lru_cache(maxsize=1)
+def _load_model():
+    """Loads the sentence embedding model on first use (optional dependency)."""
+    from sentence_transformers import SentenceTransformer
+    logger.info("Loading semantic cache embedding model %s", settings.SEMANTIC_CACHE_MODEL)
+    return SentenceTransformer(settings.SEMANTIC_CACHE_MODEL)
+
+
+@lru_cache(maxsize=1)
+def _hyperplanes(dim: int) -> np.ndarray:
+    """
+    Random projection planes for sign hashing, shaped (tables, bits, dim):
+    SEMANTIC_CACHE_LSH_TABLES independent tables of SEMANTIC_CACHE_LSH_BITS planes each.
+    """
+    rng = np.random.default_rng(_LSH_SEED)
+    shape = (settings.SEMANTIC_CACHE_LSH_TABLES, settings.SEMANTIC_CACHE_LSH_BITS, dim)
+    return rng.standard_normal(shape).astype(np.float32)
+
+
+def embed_nlq(nlq: str) -> np.ndarray:
+    """
+    Returns the unit-length embedding of an NLQ. CPU-bound; call off the event loop.
+    Module-level (picklable) so it can run in a process pool, which loads its own model copy.
+    """
+    return _load_model().encode(nlq, normalize_embeddings=True).astype(np.float32)
+
+
+def lsh_buckets(embedding: np.ndarray) -> List[str]:
+    """
+    Hashes an embedding to one coarse bucket per table ("{table}:{bits}"), one bit per
+    hyperplane side. Two embeddings at cosine c share a table's bucket with probability
+    p^bits, where p = 1 - acos(c)/pi, and share at least one bucket with probability
+    1 - (1 - p^bits)^tables: with the defaults (8 tables of 8 bits) about 0.99 at
+    c = 0.95 and 0.93 at c = 0.9, where a single 16-bit table would manage 0.18 and 0.09.
+    """
+    bits = (_hyperplanes(embedding.shape[0]) @ embedding) > 0
+    return [f"{table}:{np.packbits(row).tobytes().hex()}" for table, row in enumerate(bits)]
+
+
+class SemanticNLQIndex:
+    """
+    Finds a previously answered NLQ that is a paraphrase of a new one.
+
+    Each cached NLQ's embedding is stored under `nlq_emb:{sig}` (packed float16) and its
+    signature is added to the set of each of its LSH buckets `nlq_lsh:{table}:{bits}`.
+    A lookup compares the new embedding only against the candidates sharing at least one
+    bucket with it and returns the signature of the closest one if its cosine similarity
+    clears SEMANTIC_CACHE_THRESHOLD.
+    """
+
+    def __init__(self, cache: RedisCache, executor: Optional[Executor] = None):
+        self.cache = cache
+        # Where embeddings are computed; None means the loop's default thread executor
+        self.executor = executor
+
+    async def _embed(self, nlq: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, embed_nlq, nlq)
+
+    async def lookup(self, nlq: str) -> Tuple[Optional[str], np.ndarray]:
+        """
+        Returns (intent signature of a cached paraphrase of `nlq` or None, embedding of `nlq`).
+        Pass the embedding on to `add` after a miss, so the NLQ isn't embedded twice.
+        """
+        embedding = await self._embed(nlq)
+        candidates = list(await self.cache.get_members(*(f"nlq_lsh:{bucket}" for bucket in lsh_buckets(embedding))))
+        if not candidates:
+            return None, embedding
+
+        packed = await self.cache.get_many([f"nlq_emb:{sig}" for sig in candidates])
+        best_sig, best_score = None, settings.SEMANTIC_CACHE_THRESHOLD
+        for sig, value in zip(candidates, packed):
+            if not isinstance(value, str):
+                continue # Expired since the bucket was written
+            candidate = np.frombuffer(base64.b64decode(value), dtype=np.float16).astype(np.float32)
+            score = float(candidate @ embedding)
+            if score >= best_score:
+                best_sig, best_score = sig, score
+
+        if best_sig:
+            logger.info("Semantic cache match (cosine %.3f) for NLQ: '%.100s'", best_score, nlq)
+        return best_sig, embedding
+
+    async def add(self, nlq: str, sig: str, embedding: Optional[np.ndarray] = None):
+        """
+        Indexes `nlq` (already cached under `nlq:{sig}`) for future paraphrase lookups.
+        `embedding` is the one `lookup` returned for it, if any; otherwise it is computed.
+        """
+        if embedding is None:
+            embedding = await self._embed(nlq)
+        packed = base64.b64encode(embedding.astype(np.float16).tobytes()).decode()
+        # One round trip for the embedding and every bucket; RedisError is left to the caller
+        async with self.cache.pipeline() as pipe:
+            pipe.set(f"nlq_emb:{sig}", packed, ex=settings.NLQ_CACHE_TTL)
+            for bucket in lsh_buckets(embedding):
+                pipe.sadd(f"nlq_lsh:{bucket}", sig)
+                pipe.expire(f"nlq_lsh:{bucket}", settings.NLQ_CACHE_TTL)
+            await pipe.execute()
+
+
+# Global index, created in the app's startup event when enabled and Redis is available
+semantic_index: Optional[SemanticNLQIndex] = None
+
+def init_semantic_index(cache: Optional[RedisCache], executor: Optional[Executor] = None) -> Optional[SemanticNLQIndex]:
+    """Creates the global semantic index if SEMANTIC_CACHE_ENABLED and a cache client exists."""
+    global semantic_index
+    if settings.SEMANTIC_CACHE_ENABLED and cache is not None:
+        semantic_index = SemanticNLQIndex(cache, executor)
+        logger.info("Semantic NLQ cache enabled.")
+    else:
+        semantic_index = None
+    return semantic_index
+
+def get_semantic_index() -> Optional[SemanticNLQIndex]:
+    """Dependency function to get the semantic index (None when disabled)."""
+    return semantic_index
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
+from functools import lru_cache
 from typing import Optional
 
 # Load .env file for local development
@@ -13,17 +14,77 @@ class Settings(BaseSettings):
     TRINO_USER: str = Field(default="trino", validation_alias="TRINO_USER")
     TRINO_CATALOG: str = Field(default="tpch", validation_alias="TRINO_CATALOG")
     TRINO_SCHEMA: str = Field(default="sf1", validation_alias="TRINO_SCHEMA")
+    TRINO_PASSWORD: Optional[str] = Field(default=None, validation_alias="TRINO_PASSWORD") # Basic auth when set (requires https)
+    TRINO_HTTP_SCHEME: str = Field(default="http", validation_alias="TRINO_HTTP_SCHEME")
+    TRINO_CONN_TIMEOUT: float = Field(default=30, validation_alias="TRINO_CONN_TIMEOUT") # Seconds; also the wait for a pooled connection
+    TRINO_MAX_RETRIES: int = Field(default=3, validation_alias="TRINO_MAX_RETRIES") # Retries of transient (connection) errors
+    TRINO_RETRY_DELAY: float = Field(default=2, validation_alias="TRINO_RETRY_DELAY") # Seconds before the first retry; doubles each time
+    TRINO_POOL_SIZE: int = Field(default=16, validation_alias="TRINO_POOL_SIZE") # Concurrent Trino connections
+    TRINO_MAX_CONCURRENCY: int = Field(default=16, validation_alias="TRINO_MAX_CONCURRENCY") # In-flight orchestrator statements per process
     
+    # LLM Configuration
+    LLM_PROVIDER: str = Field(default="openai", validation_alias="LLM_PROVIDER")
+    OPENAI_API_KEY: Optional[str] = Field(default=None, validation_alias="OPENAI_API_KEY")
+    OPENAI_MODEL_GENERATION: str = Field(default="gpt-4-turbo-preview", validation_alias="OPENAI_MODEL_GENERATION")
+    OPENAI_MODEL_ANALYSIS: str = Field(default="gpt-3.5-turbo", validation_alias="OPENAI_MODEL_ANALYSIS")
+    OPENAI_MODEL_CORRECTION: str = Field(default="gpt-4-turbo-preview", validation_alias="OPENAI_MODEL_CORRECTION")
+    OPENAI_MODEL_EXPLANATION: str = Field(default="gpt-3.5-turbo", validation_alias="OPENAI_MODEL_EXPLANATION")
+
     # Service Configuration
+    APP_NAME: str = Field(default="Trino Smol Agent", validation_alias="APP_NAME")
+    APP_VERSION: str = Field(default="0.1.0", validation_alias="APP_VERSION")
     API_KEY: str = Field(validation_alias="API_KEY")
     LOG_LEVEL: str = Field(default="INFO", validation_alias="LOG_LEVEL")
+    MAX_WORKERS: int = Field(default=64, validation_alias="MAX_WORKERS") # Threads for blocking orchestration work
+    UVICORN_WORKERS: Optional[int] = Field(default=None, validation_alias="WEB_CONCURRENCY") # Server processes; default: CPU count
+    MAX_PROMPT_CHARS: int = Field(default=8000, validation_alias="MAX_PROMPT_CHARS") # Per message content
+    MAX_MESSAGES: int = Field(default=50, validation_alias="MAX_MESSAGES") # Per request
     
+    # Redis Cache
+    REDIS_HOST: str = Field(default="localhost", validation_alias="REDIS_HOST")
+    REDIS_PORT: int = Field(default=6379, validation_alias="REDIS_PORT")
+    REDIS_DB: int = Field(default=0, validation_alias="REDIS_DB")
+    REDIS_PASSWORD: Optional[str] = Field(default=None, validation_alias="REDIS_PASSWORD")
+    REDIS_MAX_CONNECTIONS: int = Field(default=64, validation_alias="REDIS_MAX_CONNECTIONS") # Pool size per process
+    SCHEMA_CACHE_TTL: int = Field(default=3600, validation_alias="SCHEMA_CACHE_TTL") # Seconds
+
+    # In-process Schema Cache (in front of Redis/Trino)
+    SCHEMA_LOCAL_TTL: int = Field(default=60, validation_alias="SCHEMA_LOCAL_TTL") # Seconds
+
+    # NLQ Response Cache
+    NLQ_CACHE_TTL: int = Field(default=900, validation_alias="NLQ_CACHE_TTL") # Seconds; results go stale with the data
+    NLQ_SQL_TTL: int = Field(default=86400, validation_alias="NLQ_SQL_TTL") # Validated SQL per NLQ and schema version
+    NLQ_EXPLANATION_TTL: int = Field(default=86400, validation_alias="NLQ_EXPLANATION_TTL") # Explanation of that SQL
+
+    # Query Results
+    MAX_RESULT_ROWS: int = Field(default=100, validation_alias="MAX_RESULT_ROWS") # Rows fetched for non-streaming responses
+
+    # Semantic NLQ Cache (paraphrase matching; requires sentence-transformers)
+    SEMANTIC_CACHE_ENABLED: bool = Field(default=False, validation_alias="SEMANTIC_CACHE_ENABLED")
+    SEMANTIC_CACHE_MODEL: str = Field(default="sentence-transformers/all-MiniLM-L6-v2", validation_alias="SEMANTIC_CACHE_MODEL")
+    SEMANTIC_CACHE_THRESHOLD: float = Field(default=0.95, validation_alias="SEMANTIC_CACHE_THRESHOLD") # Min cosine similarity
+    SEMANTIC_CACHE_LSH_TABLES: int = Field(default=8, validation_alias="SEMANTIC_CACHE_LSH_TABLES") # Independent hash tables; more raise recall
+    SEMANTIC_CACHE_LSH_BITS: int = Field(default=8, validation_alias="SEMANTIC_CACHE_LSH_BITS") # Bucket hash width per table; more shrink candidate sets
+    CPU_POOL_WORKERS: Optional[int] = Field(default=None, validation_alias="CPU_POOL_WORKERS") # Embedding processes per server worker (each loads the model); default: CPU count / WEB_CONCURRENCY, at least 1
+
+    # Streaming Responses
+    STREAM_BATCH_SIZE: int = Field(default=100, validation_alias="STREAM_BATCH_SIZE") # Rows fetched per Trino batch
+    STREAM_QUEUE_BATCHES: int = Field(default=4, validation_alias="STREAM_QUEUE_BATCHES") # Batches buffered ahead of the client
+
     # SmolAgent Configuration
     AGENT_MAX_RETRIES: int = Field(default=2, validation_alias="AGENT_MAX_RETRIES")
+    SPECULATIVE_N: int = Field(default=1, ge=1, le=4, validation_alias="SPECULATIVE_N") # Parallel correction samples per retry; 1 disables
+    GEN_MODEL_RACE: str = Field(default="", validation_alias="GEN_MODEL_RACE") # Comma-separated models raced for the first draft, cheapest first; empty disables
+    GEN_MODEL_MAX_CONCURRENCY: int = Field(default=8, validation_alias="GEN_MODEL_MAX_CONCURRENCY") # In-flight race calls per model
+    LLM_MAX_CONCURRENCY: int = Field(default=32, validation_alias="LLM_MAX_CONCURRENCY") # In-flight LLM calls per process
+    PROMPT_ENGINE: str = Field(default="jinja2", validation_alias="PROMPT_ENGINE") # "jinja2" or "minijinja"
+    JINJA_BYTECODE_CACHE_DIR: Optional[str] = Field(default=None, validation_alias="JINJA_BYTECODE_CACHE_DIR") # Compiled prompt templates
+    AGENT_ENABLE_ANALYSIS: bool = Field(default=False, validation_alias="AGENT_ENABLE_ANALYSIS") # Extra LLM call, run alongside schema retrieval
     
     class Config:
         env_file = ".env"
         case_sensitive = True
+        extra = "ignore" # Unrelated .env entries (e.g. for other tools) must not fail startup
 
 # Instantiate settings object for easy import
 settings = Settings()
@@ -31,8 +92,12 @@ settings = Settings()
 # --- Example LLM Client Setup (adjust based on smol-agent/provider) ---
 # This part might live elsewhere or be handled directly by smol-agent's backend config
 
+@lru_cache(maxsize=None)
 def get_llm_client(model_name: str):
-    """Placeholder factory for getting an LLM client instance."""
+    """
+    Placeholder factory for getting an LLM client instance.
+    Memoized per model, so callers share one client (and its HTTP connection pool).
+    """
     if settings.LLM_PROVIDER == "openai":
         import openai
         if not settings.OPENAI_API_KEY:
@@ -1,7 +1,12 @@
+import asyncio
+import logging
+import queue
 import time
-from typing import List, Dict, Any, Optional, Tuple
-from trino.dbapi import connect
-from trino.exceptions import TrinoError
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+from trino.auth import BasicAuthentication
+from trino.dbapi import connect, Connection
+from trino.exceptions import TrinoError, TrinoUserError
 from requests.exceptions import ConnectionError as RequestsConnectionError # Alias to avoid name clash
 
 from src.config import settings
@@ -12,120 +17,250 @@ logger = get_logger(__name__)
 class TrinoExecutor:
     """Handles connection and execution of queries against Trino."""
 
-    def __init__(self):
-        # Connection pooling is handled by the underlying trino client's session
-        # but we might want to manage the connection object itself
-        self.conn = None
-        self._connect() # Attempt initial connection
-
-    def _connect(self):
-        """Establishes connection to Trino."""
-        if self.conn:
-            try:
-                # Simple check if connection is alive (may not be foolproof)
-                self.conn.cursor().execute("SELECT 1")
-                logger.debug("Trino connection is alive.")
-                return # Connection likely still valid
-            except (TrinoError, AttributeError, RequestsConnectionError) as e:
-                logger.warning(f"Trino connection check failed ({type(e).__name__}), reconnecting. Error: {e}")
-                self.conn = None # Force reconnect
+    def __init__(self, pool_size: Optional[int] = None):
+        # A Trino DBAPI connection must not be shared by concurrent cursors, so each
+        # request thread checks one out of this pool. Slots start empty (None) and
+        # are connected lazily on first checkout.
+        pool_size = pool_size or settings.TRINO_POOL_SIZE
+        self._pool: "queue.Queue[Optional[Connection]]" = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(None)
 
+    def _connect(self) -> Connection:
+        """Opens a new connection to Trino."""
         logger.info(f"Connecting to Trino at {settings.TRINO_HTTP_SCHEME}://{settings.TRINO_HOST}:{settings.TRINO_PORT}")
         try:
-            self.conn = connect(
+            conn = connect(
                 host=settings.TRINO_HOST,
                 port=settings.TRINO_PORT,
                 user=settings.TRINO_USER,
                 catalog=settings.TRINO_CATALOG,
                 schema=settings.TRINO_SCHEMA,
                 http_scheme=settings.TRINO_HTTP_SCHEME,
-                password=settings.TRINO_PASSWORD,
+                # The DBAPI takes credentials as an auth object, not a password argument
+                auth=BasicAuthentication(settings.TRINO_USER, settings.TRINO_PASSWORD) if settings.TRINO_PASSWORD else None,
                 http_headers={'Trino-User': settings.TRINO_USER}, # Recommended header
                 request_timeout=settings.TRINO_CONN_TIMEOUT,
                 # Add source or other relevant session properties if needed
                 # session_properties={"query_max_run_time": "10m"}
             )
             logger.info("Trino connection established successfully.")
+            return conn
         except (TrinoError, RequestsConnectionError) as e:
             logger.error(f"Failed to connect to Trino: {e}")
-            self.conn = None # Ensure conn is None if connection failed
             raise ConnectionError(f"Could not establish connection to Trino: {e}") from e
 
+    @contextmanager
+    def _connection(self) -> Iterator[Connection]:
+        """
+        Checks a connection out of the pool for the duration of the block, connecting lazily.
+        A pooled connection is trusted as-is: if it fails at the transport level it is
+        closed and dropped here, and the slot reconnects on its next checkout.
+        """
+        try:
+            conn = self._pool.get(timeout=settings.TRINO_CONN_TIMEOUT)
+        except queue.Empty:
+            raise ConnectionError("Timed out waiting for a pooled Trino connection.")
+        try:
+            if conn is None:
+                conn = self._connect()
+            yield conn
+        except (RequestsConnectionError, ConnectionError):
+            if conn is not None:
+                self._discard(conn)
+            conn = None # Force reconnect on connection errors
+            raise
+        finally:
+            self._pool.put(conn)
 
-    def _execute_with_retry(self, sql: str, is_validation: bool = False) -> Tuple[Optional[List[Tuple]], Optional[List[str]], Optional[Exception]]:
-        """Internal execution logic with retry for transient errors."""
-        last_exception = None
-        for attempt in range(settings.TRINO_MAX_RETRIES + 1):
+    @staticmethod
+    def _discard(conn: Connection):
+        """Closes a broken connection, releasing its HTTP session; it is already unusable, so errors are only logged."""
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug("Error closing dropped Trino connection: %s", e)
+
+    def close(self):
+        """Closes all pooled connections."""
+        while True:
             try:
-                if not self.conn:
-                    self._connect() # Attempt reconnect if connection is missing
-                if not self.conn:
-                    raise ConnectionError("Trino connection not available.") # Bail if reconnect failed
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
 
-                cursor = self.conn.cursor()
-                logger.debug(f"Executing SQL (Attempt {attempt+1}/{settings.TRINO_MAX_RETRIES+1}):\n{sql[:500]}{'...' if len(sql) > 500 else ''}")
-                cursor.execute(sql)
 
-                if is_validation:
-                    # For validation (like LIMIT 0 or EXPLAIN), we don't fetch rows, just check for errors
-                    logger.info(f"SQL validation successful for: {sql[:100]}...")
-                    return None, None, None # Success (no rows, no columns, no error)
-                else:
+    def _do_execute(self, sql: str, is_validation: bool = False, max_rows: Optional[int] = None, params: Optional[List[Any]] = None, attempt: int = 0) -> Tuple[Optional[List[Tuple]], Optional[List[str]]]:
+        """
+        Single execution attempt on a pooled connection. Raises on failure.
+        If `max_rows` is set, at most that many rows are fetched and the rest of the query is cancelled.
+        `params` are bound to `?` placeholders in `sql` by the DBAPI driver.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Executing SQL (Attempt %d/%d):\n%s%s", attempt + 1, settings.TRINO_MAX_RETRIES + 1, sql[:500], '...' if len(sql) > 500 else '')
+            cursor.execute(sql, params)
+
+            if is_validation:
+                # For validation (like LIMIT 0 or EXPLAIN), we don't fetch rows, just check for errors
+                logger.info("SQL validation successful for: %.100s...", sql)
+                return None, None # Success (no rows, no columns)
+            else:
+                if max_rows is None:
                     rows = cursor.fetchall()
-                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
-                    logger.info(f"SQL execution successful. Fetched {len(rows)} rows.")
-                    return rows, columns, None # Success
+                else:
+                    rows = cursor.fetchmany(max_rows)
+                    cursor.cancel() # Don't let Trino keep producing rows nobody reads
+                columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                logger.info("SQL execution successful. Fetched %d rows.", len(rows))
+                return rows, columns
+
+    def _retry_delay(self, sql: str, error: Exception, attempt: int) -> Optional[float]:
+        """Returns the backoff before the next attempt, or None if `error` should not be retried."""
+        if isinstance(error, TrinoUserError):
+            # Semantic/syntax error in the SQL itself (the expected failure when validating drafts)
+            logger.info("Trino rejected SQL: %s", error)
+            return None
+        logger.warning("Trino execution error (Attempt %d): %s - %s", attempt + 1, type(error).__name__, error)
+        # Check if error is likely transient (e.g., connection error, timeout)
+        # More specific error checking could be added here based on TrinoError subtypes
+        is_transient = isinstance(error, (RequestsConnectionError, ConnectionError)) # Add specific Trino transient codes if known
 
+        if is_transient and attempt < settings.TRINO_MAX_RETRIES:
+            wait_time = settings.TRINO_RETRY_DELAY * (2 ** attempt) # Exponential backoff
+            logger.warning("Retrying in %s seconds...", wait_time) # The failed connection was already dropped by _connection
+            return wait_time
+        logger.error("Non-retryable error or max retries reached for SQL: %.100s...", sql)
+        return None
+
+    def _execute_with_retry(self, sql: str, is_validation: bool = False, max_rows: Optional[int] = None, params: Optional[List[Any]] = None) -> Tuple[Optional[List[Tuple]], Optional[List[str]], Optional[Exception]]:
+        """Internal execution logic with retry for transient errors. Blocks the calling thread while backing off."""
+        last_exception = None
+        for attempt in range(settings.TRINO_MAX_RETRIES + 1):
+            try:
+                rows, columns = self._do_execute(sql, is_validation, max_rows, params, attempt)
+                return rows, columns, None # Success
             except (TrinoError, RequestsConnectionError, ConnectionError) as e:
-                logger.warning(f"Trino execution error (Attempt {attempt+1}): {type(e).__name__} - {e}")
                 last_exception = e
-                # Check if error is likely transient (e.g., connection error, timeout)
-                # More specific error checking could be added here based on TrinoError subtypes
-                is_transient = isinstance(e, (RequestsConnectionError, ConnectionError)) # Add specific Trino transient codes if known
-
-                if is_transient and attempt < settings.TRINO_MAX_RETRIES:
-                    wait_time = settings.TRINO_RETRY_DELAY * (2 ** attempt) # Exponential backoff
-                    logger.warning(f"Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                    # Ensure connection is re-established before next retry
-                    if isinstance(e, (RequestsConnectionError, ConnectionError)):
-                         self.conn = None # Force reconnect on connection errors
-                else:
-                    logger.error(f"Non-retryable error or max retries reached for SQL: {sql[:100]}...")
+                wait_time = self._retry_delay(sql, e, attempt)
+                if wait_time is None:
                     return None, None, e # Return the final error
+                time.sleep(wait_time)
 
         # Should only be reached if loop finishes due to retries exhausting
-        logger.error(f"Failed to execute SQL after {settings.TRINO_MAX_RETRIES + 1} attempts.")
+        logger.error("Failed to execute SQL after %d attempts.", settings.TRINO_MAX_RETRIES + 1)
         return None, None, last_exception
 
+    async def _execute_with_retry_async(self, sql: str, is_validation: bool = False, max_rows: Optional[int] = None, params: Optional[List[Any]] = None) -> Tuple[Optional[List[Tuple]], Optional[List[str]], Optional[Exception]]:
+        """
+        Async sibling of _execute_with_retry for callers on the event loop: each attempt
+        runs in a worker thread and the backoff is an asyncio.sleep, so nothing blocks the loop.
+        """
+        last_exception = None
+        for attempt in range(settings.TRINO_MAX_RETRIES + 1):
+            try:
+                rows, columns = await asyncio.to_thread(self._do_execute, sql, is_validation, max_rows, params, attempt)
+                return rows, columns, None # Success
+            except (TrinoError, RequestsConnectionError, ConnectionError) as e:
+                last_exception = e
+                wait_time = self._retry_delay(sql, e, attempt)
+                if wait_time is None:
+                    return None, None, e # Return the final error
+                await asyncio.sleep(wait_time)
 
-    def execute_query(self, sql: str) -> Tuple[List[Dict[str, Any]], Optional[Exception]]:
-        """Executes a SQL query and returns results as list of dicts, or an exception."""
-        rows, columns, error = self._execute_with_retry(sql, is_validation=False)
+        # Should only be reached if loop finishes due to retries exhausting
+        logger.error("Failed to execute SQL after %d attempts.", settings.TRINO_MAX_RETRIES + 1)
+        return None, None, last_exception
 
+    @staticmethod
+    def _to_results(rows: Optional[List[Tuple]], columns: Optional[List[str]], error: Optional[Exception]) -> Tuple[List[Tuple], List[str], Optional[Exception]]:
+        """Turns raw execution output into (rows, columns, error)."""
         if error:
-            return [], error
+            return [], [], error
         if rows is None or columns is None:
              # Should not happen if error is None, but safety check
-             return [], ValueError("Execution succeeded but no rows/columns returned unexpectedly.")
+             return [], [], ValueError("Execution succeeded but no rows/columns returned unexpectedly.")
+        return rows, columns, None
+
+    def execute_query(self, sql: str, max_rows: Optional[int] = None) -> Tuple[List[Tuple], List[str], Optional[Exception]]:
+        """
+        Executes a SQL query and returns (rows, columns, error). Rows are the driver's
+        positional sequences; `columns` holds their names exactly as Trino reports them
+        (e.g. `_col0`, `Total Revenue`), shared by every row instead of one dict per row.
+        `max_rows` bounds how many rows are fetched (and held in memory); None fetches all.
+        """
+        return self._to_results(*self._execute_with_retry(sql, is_validation=False, max_rows=max_rows))
+
+    async def execute_query_async(self, sql: str, max_rows: Optional[int] = None) -> Tuple[List[Tuple], List[str], Optional[Exception]]:
+        """Async version of execute_query, for use from `async def` code."""
+        return self._to_results(*await self._execute_with_retry_async(sql, is_validation=False, max_rows=max_rows))
+
+    def stream_query(self, sql: str, batch_size: int) -> Iterator[Tuple[List[str], List[Tuple]]]:
+        """
+        Executes a SQL query and yields (columns, rows) in batches as Trino returns them.
+        Not retried: a stream that already yielded rows cannot be replayed. Raises on error.
+        Closing the generator early cancels the query.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Streaming SQL:\n%s%s", sql[:500], '...' if len(sql) > 500 else '')
+                cursor.execute(sql)
+                columns = None
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if columns is None:
+                        columns = [desc[0] for desc in cursor.description]
+                    yield columns, rows
+            finally:
+                cursor.close()
 
-        results = [dict(zip(columns, row)) for row in rows]
-        return results, None
+    @staticmethod
+    def _validation_sql(sql: str) -> str:
+        """Wraps a query so executing it only checks it, without producing rows."""
+        # EXPLAIN (TYPE VALIDATE) parses and analyzes the statement on the coordinator
+        # (names, types, permissions) without planning or scheduling it on workers,
+        # and fails with a TrinoUserError on the same semantic issues a real run would.
+        # Prefixing works for any statement shape, including WITH ... queries.
+        return f"EXPLAIN (TYPE VALIDATE) {sql.strip().rstrip(';')}"
 
     def execute_validation(self, sql: str) -> Optional[Exception]:
         """Executes a SQL statement purely for validation (e.g., syntax check). Returns exception if failed."""
-        # Example validation: Append LIMIT 0. Alternatively use EXPLAIN.
-        # Using EXPLAIN might be better but requires parsing its output.
-        # Using LIMIT 0 is simpler but might still fail later on semantic issues EXPLAIN could catch.
-        validation_sql = f"SELECT * FROM ({sql}) AS _subquery LIMIT 0"
-        # Or: validation_sql = f"EXPLAIN {sql}" # If using EXPLAIN
-
-        logger.info(f"Attempting validation with query: {validation_sql[:100]}...")
+        validation_sql = self._validation_sql(sql)
+        logger.info("Attempting validation with query: %.100s...", validation_sql)
         _, _, error = self._execute_with_retry(validation_sql, is_validation=True)
         return error
 
+    async def execute_validation_async(self, sql: str) -> Optional[Exception]:
+        """Async version of execute_validation, for use from `async def` code."""
+        validation_sql = self._validation_sql(sql)
+        logger.info("Attempting validation with query: %.100s...", validation_sql)
+        _, _, error = await self._execute_with_retry_async(validation_sql, is_validation=True)
+        return error
+
     def get_schema_info(self, target_catalog: Optional[str] = None, target_schema: Optional[str] = None) -> Tuple[Optional[str], Optional[Exception]]:
         """Fetches schema information (tables and columns) as a formatted string."""
+        tables, error = self.get_schema_tables(target_catalog, target_schema)
+        if error:
+            return None, error
+        return self.join_schema_tables(tables), None
+
+    @staticmethod
+    def join_schema_tables(tables: Dict[str, str]) -> str:
+        """Joins per-table schema blocks (as returned by `get_schema_tables`) into one schema string."""
+        return "\n\n".join(tables.values())
+
+    def get_schema_tables(self, target_catalog: Optional[str] = None, target_schema: Optional[str] = None) -> Tuple[Optional[Dict[str, str]], Optional[Exception]]:
+        """
+        Fetches schema information as one formatted block per table, keyed by table name
+        (in table order), so callers can cache or send tables individually.
+        """
         # TODO: Implement more robust schema fetching, possibly filtering,
         # and formatting it in a way the LLM understands well (e.g., CREATE TABLE statements or simplified JSON).
         # This is a very basic example.
@@ -136,40 +271,34 @@ class TrinoExecutor:
         if not catalog or not schema:
             return None, ValueError("Catalog and schema must be specified either in config or request to fetch schema.")
 
-        # Use ANSI standard information_schema
-        sql = f"""
+        # Use ANSI standard information_schema. The catalog is an identifier and can't be
+        # bound, but the schema is passed as a parameter so the statement text stays constant.
+        sql = """
         SELECT table_name, column_name, data_type
-        FROM {catalog}.information_schema.columns
-        WHERE table_schema = '{schema}'
-        ORDER BY table_name, ordinal_position;
-        """
-        rows, columns, error = self._execute_with_retry(sql, is_validation=False)
+        FROM {}.information_schema.columns
+        WHERE table_schema = ?
+        ORDER BY table_name, ordinal_position
+        """.format(catalog)
+        rows, _, error = self._execute_with_retry(sql, is_validation=False, params=[schema])
 
         if error:
             logger.error(f"Failed to fetch schema for {catalog}.{schema}: {error}")
             return None, error
         if not rows:
             logger.warning(f"No tables found in schema: {catalog}.{schema}")
-            return "", None # Return empty string if schema exists but is empty
-
-        schema_str = ""
-        current_table = None
-        for row_tuple in rows:
-            # Assuming order is table_name, column_name, data_type
-            row = dict(zip(columns, row_tuple))
-            if row['table_name'] != current_table:
-                if current_table is not None:
-                    schema_str += ");\n\n"
-                current_table = row['table_name']
-                schema_str += f"TABLE {schema}.{current_table} (\n"
-            schema_str += f"  {row['column_name']} {row['data_type']},\n"
+            return {}, None # Return no tables if schema exists but is empty
 
-        if current_table is not None:
-             # Remove trailing comma and newline, add closing parenthesis
-             schema_str = schema_str.rstrip(',\n') + "\n);"
+        # Collect column lines per table and join each once; repeated += on a growing str can go quadratic
+        columns: Dict[str, List[str]] = {}
+        for table_name, column_name, data_type in rows: # Column order fixed by the SELECT above
+            columns.setdefault(table_name, []).append(f"  {column_name} {data_type}")
+        tables = {
+            table_name: f"TABLE {schema}.{table_name} (\n" + ",\n".join(lines) + "\n);"
+            for table_name, lines in columns.items()
+        }
 
-        logger.info(f"Successfully fetched schema string for {catalog}.{schema}")
-        return schema_str, None
+        logger.info(f"Successfully fetched schema for {catalog}.{schema} ({len(tables)} tables)")
+        return tables, None
 
 
 # Global instance (or use dependency injection)
@@ -177,5 +306,4 @@ trino_executor = TrinoExecutor()
 
 def get_trino_executor() -> TrinoExecutor:
     """Dependency function to get the Trino executor."""
-    # Could add logic here to check/refresh connection if needed
     return trino_executor 
\ No newline at end of file
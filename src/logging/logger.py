@@ -1,17 +1,32 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 from src.config import settings
 
-# Basic logging setup - consider using structlog for richer structured logs
-logging.basicConfig(
-    level=settings.LOG_LEVEL.upper(),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    stream=sys.stdout,
-)
+# Basic logging setup - consider using structlog for richer structured logs.
+# Request threads only enqueue records; a background listener thread does the
+# blocking writes to stdout, so heavy logging doesn't stall request handling.
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _stream_handler, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop) # Flushes queued records on interpreter exit
+
+# The QueueHandler renders just the message (and traceback) into the record before
+# enqueuing it; the listener's formatter adds the timestamp/name/level prefix once.
+# Not set up via basicConfig, whose default formatter would prefix lines twice.
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+_root_logger = logging.getLogger()
+_root_logger.setLevel(settings.LOG_LEVEL.upper())
+_root_logger.addHandler(_queue_handler)
 
 def get_logger(name: str):
     """Gets a logger instance."""
     return logging.getLogger(name)
 
 logger = get_logger(__name__)
-logger.info(f"Logger initialized with level: {settings.LOG_LEVEL}") 
\ No newline at end of file
+logger.info("Logger initialized with level: %s", settings.LOG_LEVEL)
@@ -1,5 +1,15 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import anyio.to_thread
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from src.api import routes as api_routes
+from src.caching.cache import init_cache_client, close_cache_client, get_cache_client
+from src.caching.semantic import init_semantic_index
+from src.execution.trino_client import get_trino_executor
+from src.orchestration.agent_manager import MasterOrchestrator
 from src.config import settings
 from src.logging.logger import logger
 
@@ -8,6 +18,7 @@ app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
     description="API Service to convert Natural Language Queries to SQL using SmolAgents and Trino.",
+    default_response_class=ORJSONResponse,
     # Add other FastAPI configurations like docs_url, redoc_url etc.
 )
 
@@ -18,20 +29,41 @@ app.include_router(api_routes.router, prefix="/v1") # Prefixing with /v1 for Ope
 @app.on_event("startup")
 async def startup_event():
     logger.info(f"Starting up {settings.APP_NAME} v{settings.APP_VERSION}...")
-    # Initialize connections or resources if needed here
-    # (Trino and Redis connections are lazy/managed in their respective classes)
+    # Blocking orchestration runs in Starlette's threadpool (see run_orchestration_async),
+    # which is capped by anyio's default limiter (40 threads). Size it, and asyncio's
+    # default executor used by asyncio.to_thread, explicitly.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.MAX_WORKERS
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=settings.MAX_WORKERS))
+    # The async Redis pool must be created inside the running event loop
+    await init_cache_client()
+    # CPU-bound work (NLQ embeddings) runs in worker processes so it doesn't hold the
+    # GIL against request threads. Spawned, not forked, since this process runs threads.
+    # Every server worker gets its own pool, so by default the CPUs are split between
+    # them: total embedding processes = WEB_CONCURRENCY x CPU_POOL_WORKERS.
+    app.state.cpu_pool = None
+    if settings.SEMANTIC_CACHE_ENABLED:
+        cpu_count = os.cpu_count() or 1
+        app.state.cpu_pool = ProcessPoolExecutor(
+            max_workers=settings.CPU_POOL_WORKERS or max(1, cpu_count // (settings.UVICORN_WORKERS or cpu_count)),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    init_semantic_index(get_cache_client(), app.state.cpu_pool)
+    # (Trino connections are pooled and opened lazily by TrinoExecutor)
+    # One orchestrator serves every request; see get_orchestrator
+    app.state.orchestrator = MasterOrchestrator(
+        trino_executor=get_trino_executor(),
+        cache_client=get_cache_client()
+    )
     logger.info("Application startup complete.")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info(f"Shutting down {settings.APP_NAME}...")
-    # Clean up resources if needed (e.g., explicitly close connections)
-    # trino_executor = get_trino_executor()
-    # if trino_executor.conn:
-    #     trino_executor.conn.close()
-    # cache_client = get_cache_client()
-    # if cache_client:
-    #     cache_client.client.close() # Close Redis connection
+    get_trino_executor().close()
+    await close_cache_client()
+    if app.state.cpu_pool is not None:
+        app.state.cpu_pool.shutdown(cancel_futures=True)
     logger.info("Application shutdown complete.")
 
 # --- Root Endpoint (Optional) ---
@@ -39,10 +71,20 @@ async def shutdown_event():
 async def read_root():
     return {"message": f"Welcome to {settings.APP_NAME}"}
 
-# --- Run with Uvicorn (for local development) ---
-# This block is typically used for running directly with `python src/main.py`
-# In production, you'd use `uvicorn src.main:app --host 0.0.0.0 --port 8000`
+# --- Run with Uvicorn ---
+# This block is used for running directly with `python -m src.main`.
+# uvloop and httptools replace asyncio's default loop and the pure-Python h11 parser.
+# Each worker is a separate process with its own Trino pool and Redis pool, so the
+# cluster sees up to workers x TRINO_POOL_SIZE connections (and likewise for Redis).
 if __name__ == "__main__":
     import uvicorn
-    logger.info("Starting Uvicorn server for local development...")
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level=settings.LOG_LEVEL.lower()) 
\ No newline at end of file
+    logger.info("Starting Uvicorn server...")
+    uvicorn.run(
+        "src.main:app", # Import string, required for multiple workers
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=settings.UVICORN_WORKERS or os.cpu_count(),
+        log_level=settings.LOG_LEVEL.lower()
+    ) 
\ No newline at end of file
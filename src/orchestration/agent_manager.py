@@ -1,27 +1,103 @@
+import asyncio
+import hashlib
 import os
-from jinja2 import Environment, FileSystemLoader
+import re
+from dataclasses import dataclass
+from cachetools import TTLCache
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from typing import Optional, Dict, Any, Tuple, List
 
+from redis.exceptions import RedisError
 from smol_agent import SmolAgent # Assuming SmolAgent is importable
 
 from src.config import settings, get_llm_client
 from src.execution.trino_client import TrinoExecutor, get_trino_executor
-from src.caching.cache import RedisCache, get_cache_client
+from src.caching.cache import RedisCache, get_cache_client, nlq_key, compress_text, decompress_text
+from src.orchestration.singleflight import SingleFlight
+from src.orchestration.sql_check import local_sql_error
 from src.logging.logger import get_logger
 
 logger = get_logger(__name__)
 
-# Setup Jinja2 environment
+# Setup Jinja2 environment.
+# Prompts are plain text sent to an LLM, not HTML, so nothing is autoescaped: escaping
+# would turn quotes and `<`/`&` in NLQs, schemas and SQL drafts into HTML entities.
+# Compiled template bytecode is persisted on disk, so restarted or additional workers
+# skip recompiling the .j2 sources; prompts only change on deploy, so no auto-reload.
 prompt_dir = os.path.join(os.path.dirname(__file__), 'prompts')
-jinja_env = Environment(loader=FileSystemLoader(prompt_dir), autoescape=True)
+if settings.JINJA_BYTECODE_CACHE_DIR:
+    os.makedirs(settings.JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+jinja_env = Environment(
+    loader=FileSystemLoader(prompt_dir),
+    autoescape=False,
+    bytecode_cache=FileSystemBytecodeCache(settings.JINJA_BYTECODE_CACHE_DIR), # None: per-user temp dir
+    auto_reload=False
+)
+# Prompts are fixed at deploy time, so every template is resolved once at import
+_TEMPLATES = {
+    name: jinja_env.get_template(name)
+    for name in os.listdir(prompt_dir) if name.endswith('.j2')
+}
+
+def _read_prompt(name: str) -> Optional[str]:
+    """MiniJinja loader: returns a template's source, or None if it does not exist."""
+    try:
+        with open(os.path.join(prompt_dir, name), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+# Optional Rust-backed renderer (PROMPT_ENGINE=minijinja); Jinja2 stays the default and fallback.
+# Autoescaping is off, as in the Jinja2 environment above, so both render identically.
+minijinja_env = None
+if settings.PROMPT_ENGINE == "minijinja":
+    from minijinja import Environment as MJEnvironment
+    minijinja_env = MJEnvironment(loader=_read_prompt, auto_escape_callback=lambda name: None)
+    logger.info("Rendering prompts with MiniJinja.")
+
+# Markdown code fences LLMs wrap SQL in, opening (optionally tagged sql) or closing
+_FENCE_RE = re.compile(r"```(?:sql)?\s*|\s*```")
+
+# Leading SELECT keyword, matched in place instead of upper-casing a copy of the whole SQL
+_SELECT_RE = re.compile(r"\s*select\b", re.IGNORECASE)
+
+# Words in analysis hints that may name a table
+_IDENTIFIER_RE = re.compile(r"[a-z_][a-z0-9_]*")
+
+# Non-whitespace characters of streamed SQL inspected before deciding it is not a SELECT
+_SQL_PREFIX_CHARS = 16
 
 class OrchestrationError(Exception):
     """Custom exception for orchestration failures."""
     pass
 
 
+@dataclass(slots=True)
+class OrchestrationResult:
+    """Per-request orchestration output: status, SQL, explanation, results and errors."""
+    status: str = "FAILED"
+    nlq: str = ""
+    analysis_hints: Optional[str] = None
+    schema_info: Optional[str] = None
+    sql_generated: Optional[str] = None
+    sql_final: Optional[str] = None
+    validation_error: Optional[str] = None
+    execution_error: Optional[str] = None
+    explanation: Optional[str] = None
+    results: Optional[List[Any]] = None # Positional rows; see `columns`
+    columns: Optional[List[str]] = None # Result column names, as Trino reports them
+    results_truncated: bool = False
+    error_message: Optional[str] = None
+
+
 class MasterOrchestrator:
-    """Orchestrates the NLQ-to-SQL process using specialized agents."""
+    """
+    Orchestrates the NLQ-to-SQL process using specialized agents.
+
+    A single instance is created at startup and shared by all requests, which
+    run concurrently as coroutines on the event loop. Keep per-request state in
+    locals (like `output` in `process_nlq`), never on `self`.
+    """
 
     def __init__(self, trino_executor: TrinoExecutor, cache_client: Optional[RedisCache]):
         self.trino = trino_executor
@@ -33,107 +109,290 @@ class MasterOrchestrator:
         # self.llm_backend_analysis = get_llm_client(settings.OPENAI_MODEL_ANALYSIS)
         # ... etc for other models
 
+        # One SmolAgent per (agent name, model), built on first use and reused by every
+        # request so LLM client setup and its connection pool are paid once
+        self._agents: Dict[Tuple[str, str], SmolAgent] = {}
+        # Short-lived in-process copy of the full schema string, keyed by (catalog, schema),
+        # in front of Redis and Trino. Concurrent misses share one fetch.
+        self._schema_local: TTLCache = TTLCache(maxsize=32, ttl=settings.SCHEMA_LOCAL_TTL)
+        self._schema_flights: SingleFlight[str] = SingleFlight()
+        # Caps concurrent LLM calls across all requests (speculative drafts multiply them)
+        self._llm_semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        # Caps concurrent Trino statements from this process (candidate validations fan out)
+        self._trino_semaphore = asyncio.Semaphore(settings.TRINO_MAX_CONCURRENCY)
+        # Runs of process_nlq in progress, keyed by (nlq_key, force_refresh)
+        self._nlq_flights: SingleFlight[OrchestrationResult] = SingleFlight()
+        # Models raced for the first SQL draft (GEN_MODEL_RACE), each with its own rate limit
+        self._race_models = [m.strip() for m in settings.GEN_MODEL_RACE.split(",") if m.strip()]
+        self._model_semaphores = {
+            model: asyncio.Semaphore(settings.GEN_MODEL_MAX_CONCURRENCY) for model in self._race_models
+        }
+
         logger.info("Master Orchestrator initialized.")
 
     def _load_prompt(self, template_name: str, context: Dict[str, Any]) -> str:
-        """Loads and renders a Jinja2 prompt template."""
+        """Loads and renders a prompt template with the configured PROMPT_ENGINE."""
         try:
-            template = jinja_env.get_template(template_name)
-            return template.render(context)
+            if minijinja_env is not None:
+                return minijinja_env.render_template(template_name, **context)
+            return _TEMPLATES[template_name].render(context)
+        except KeyError as e:
+            logger.error("Unknown prompt template %s", template_name)
+            raise OrchestrationError(f"Prompt template {template_name} not found") from e
         except Exception as e:
-            logger.error(f"Failed to load or render prompt template {template_name}: {e}")
+            logger.error("Failed to load or render prompt template %s: %s", template_name, e)
             raise OrchestrationError(f"Prompt generation failed for {template_name}") from e
 
-    def _run_agent_task(self, agent_name: str, prompt: str, model_name: str) -> str:
+    def _get_agent(self, agent_name: str, model_name: str) -> SmolAgent:
+        """Returns the shared SmolAgent for this agent role and model, creating it on first use."""
+        agent = self._agents.get((agent_name, model_name))
+        if agent is None:
+            agent = self._agents.setdefault((agent_name, model_name), SmolAgent(
+                llm_backend=get_llm_client(model_name),
+                system_prompt=f"You are a {agent_name} specialized in SQL generation and analysis."
+            ))
+        return agent
+
+    async def _run_agent_task(self, agent_name: str, prompt: str, model_name: str) -> str:
         """
         Runs a specific task using SmolAgent with the specified LLM model.
         """
-        logger.info(f"Running {agent_name} task with model {model_name}...")
+        logger.info("Running %s task with model %s...", agent_name, model_name)
         
         try:
-            # Initialize SmolAgent with the appropriate LLM client
-            agent = SmolAgent(
-                llm_backend=get_llm_client(model_name),
-                system_prompt=f"You are a {agent_name} specialized in SQL generation and analysis."
-            )
+            agent = self._get_agent(agent_name, model_name)
             
-            # Execute the task and get the response
-            response = agent.execute(prompt)
+            # Execute the task and get the response. SmolAgent's execute() is blocking,
+            # so it runs in a worker thread while the loop serves other NLQs.
+            async with self._llm_semaphore:
+                response = await asyncio.to_thread(agent.execute, prompt)
             
-            # Clean up response (remove markdown backticks if present)
-            response = response.replace("```sql", "").replace("```", "").strip()
+            response = self._clean_response(response)
             
-            logger.debug(f"{agent_name} response: {response}")
+            logger.debug("%s response: %s", agent_name, response)
             return response
             
         except Exception as e:
-            logger.error(f"Error in {agent_name} task: {str(e)}")
+            logger.error("Error in %s task: %s", agent_name, e)
+            raise OrchestrationError(f"Failed to execute {agent_name} task: {str(e)}") from e
+
+    @staticmethod
+    def _clean_response(response: str) -> str:
+        """Clean up response (remove markdown backticks if present) in a single pass."""
+        if "```" in response:
+            response = _FENCE_RE.sub("", response)
+        return response.strip()
+
+    @staticmethod
+    def _normalize_sql(sql: str) -> str:
+        """
+        Strips surrounding whitespace and trailing `;` terminators, which Trino rejects,
+        so the SQL that is validated is exactly the SQL that is executed and cached.
+        """
+        return sql.strip().rstrip(";").rstrip()
+
+    @staticmethod
+    def _sql_complete(buffer: str) -> bool:
+        """True once streamed SQL ends with its terminating `;`, outside any open fence or string literal."""
+        return (
+            buffer.count("```") % 2 == 0
+            and buffer.count("'") % 2 == 0
+            and _FENCE_RE.sub("", buffer).rstrip().endswith(";")
+        )
+
+    async def _astream_agent_task(self, agent_name: str, prompt: str, model_name: str) -> str:
+        """
+        Runs a SQL-producing task like `_run_agent_task`, but streams the completion when the
+        agent supports it (`agenerate_stream`). The stream is abandoned as soon as its first
+        characters show the output is not a SELECT, or once the statement's terminating `;`
+        has arrived, so no tokens are waited for past that point. Agents without streaming
+        fall back to `_run_agent_task`.
+        """
+        try:
+            agent = self._get_agent(agent_name, model_name)
+        except Exception as e:
+            logger.error("Error in %s task: %s", agent_name, e)
+            raise OrchestrationError(f"Failed to execute {agent_name} task: {str(e)}") from e
+        agenerate_stream = getattr(agent, "agenerate_stream", None)
+        if agenerate_stream is None:
+            return await self._run_agent_task(agent_name, prompt, model_name)
+
+        logger.info("Streaming %s task with model %s...", agent_name, model_name)
+        buffer, prefix_checked = "", False
+        try:
+            async with self._llm_semaphore:
+                stream = agenerate_stream(prompt)
+                try:
+                    async for chunk in stream:
+                        buffer += chunk
+                        if not prefix_checked:
+                            head = _FENCE_RE.sub("", buffer).lstrip()
+                            if len(head) >= _SQL_PREFIX_CHARS:
+                                prefix_checked = True
+                                if not _SELECT_RE.match(head):
+                                    logger.warning("%s output is not a SELECT, aborting stream: %r", agent_name, head)
+                                    break
+                        if ";" in buffer and self._sql_complete(buffer):
+                            break
+                finally:
+                    # Closing the generator early cancels the rest of the completion
+                    await stream.aclose()
+        except Exception as e:
+            logger.error("Error in %s task: %s", agent_name, e)
             raise OrchestrationError(f"Failed to execute {agent_name} task: {str(e)}") from e
 
-    def _analyze_query(self, nlq: str) -> str:
+        # The stream stops on the terminating `;`, which Trino rejects; drop it with the fences
+        response = self._normalize_sql(self._clean_response(buffer))
+        logger.debug("%s response: %s", agent_name, response)
+        return response
+
+    async def _analyze_query(self, nlq: str) -> str:
         """Uses Query Analyzer Agent."""
         prompt = self._load_prompt("query_analyzer.j2", {"nlq": nlq})
-        analysis = self._run_agent_task(
+        analysis = await self._run_agent_task(
             "Query Analyzer",
             prompt,
             settings.OPENAI_MODEL_ANALYSIS
         )
         return analysis
 
-    def _retrieve_schema(self, analysis_hints: Optional[str] = None) -> str:
+    async def _retrieve_schema(self, analysis_hints: Optional[str] = None) -> str:
         """
-        Uses Schema Retrieval Agent logic (cache check + Trino call).
-        'analysis_hints' could potentially be used to fetch a subset of the schema in future.
+        Uses Schema Retrieval Agent logic (local cache, then Redis, then Trino call).
+        The schema is cached zstd-compressed, both whole and sharded per table. With
+        'analysis_hints', only the cached tables the hints name are fetched; if they
+        name none (or the shards are missing), the whole schema is returned.
         """
         cache_key = f"schema:{settings.TRINO_CATALOG}:{settings.TRINO_SCHEMA}"
-        cached_schema = self.cache.get(cache_key) if self.cache else None
+        if analysis_hints and self.cache:
+            schema_subset = await self._retrieve_schema_tables(cache_key, analysis_hints)
+            if schema_subset:
+                return schema_subset
+
+        local_key = (settings.TRINO_CATALOG, settings.TRINO_SCHEMA)
+        schema_str = self._schema_local.get(local_key)
+        if schema_str is None:
+            async def fetch() -> str:
+                schema = await self._fetch_schema(cache_key)
+                self._schema_local[local_key] = schema
+                return schema
+            schema_str = await self._schema_flights.do(local_key, fetch)
+        return schema_str
 
+    async def _fetch_schema(self, cache_key: str) -> str:
+        """Reads the full schema from Redis, or fetches it from Trino and caches it there."""
+        cached_schema = await self.cache.get(cache_key) if self.cache else None
+        if isinstance(cached_schema, bytes):
+            cached_schema = decompress_text(cached_schema)
+        else:
+            cached_schema = None # Missing, or an uncompressed entry from before compression
         if cached_schema:
             logger.info("Schema retrieved from cache.")
             return cached_schema
 
         logger.info("Schema not in cache, fetching from Trino...")
-        schema_str, error = self.trino.get_schema_info(
+        tables, error = await asyncio.to_thread(
+            self.trino.get_schema_tables,
             target_catalog=settings.TRINO_CATALOG,
             target_schema=settings.TRINO_SCHEMA
         )
         if error:
-            logger.error(f"Failed to retrieve schema: {error}")
+            logger.error("Failed to retrieve schema: %s", error)
             raise OrchestrationError(f"Schema retrieval failed: {error}") from error
-        if schema_str is None:
+        if tables is None:
              raise OrchestrationError("Schema retrieval returned None unexpectedly.")
-
+        schema_str = self.trino.join_schema_tables(tables)
 
         if self.cache:
-            self.cache.set(cache_key, schema_str, ttl=settings.SCHEMA_CACHE_TTL)
+            await self._cache_schema(cache_key, schema_str, tables)
 
         return schema_str
 
-    def _generate_sql(self, nlq: str, schema_info: str, analysis_hints: str) -> str:
-        """Uses SQL Generation Agent."""
-        prompt = self._load_prompt("sql_generator.j2", {
+    async def _cache_schema(self, cache_key: str, schema_str: str, tables: Dict[str, str]):
+        """Writes the whole schema, its table set and every table shard in one pipelined round trip."""
+        ttl = settings.SCHEMA_CACHE_TTL
+        try:
+            async with self.cache.pipeline() as pipe:
+                pipe.set(cache_key, compress_text(schema_str), ex=ttl)
+                for name, block in tables.items():
+                    pipe.set(f"{cache_key}:table:{name}", compress_text(block), ex=ttl)
+                if tables:
+                    pipe.sadd(f"{cache_key}:tables", *tables)
+                    pipe.expire(f"{cache_key}:tables", ttl)
+                await pipe.execute()
+        except RedisError as e:
+            logger.error("Failed to cache schema under %s: %s", cache_key, e)
+
+    async def _retrieve_schema_tables(self, cache_key: str, analysis_hints: str) -> Optional[str]:
+        """Fetches (MGET) just the cached schema tables named in `analysis_hints`, or None."""
+        hinted = set()
+        for word in _IDENTIFIER_RE.findall(analysis_hints.lower()):
+            hinted.add(word)
+            if word.endswith("s"):
+                hinted.add(word[:-1]) # "customers" -> customer table
+        tables = sorted(t for t in await self.cache.get_members(f"{cache_key}:tables") if t.lower() in hinted)
+        if not tables:
+            return None
+
+        shards = await self.cache.get_many([f"{cache_key}:table:{t}" for t in tables])
+        blocks = [decompress_text(shard) if isinstance(shard, bytes) else None for shard in shards]
+        if not all(blocks):
+            return None # Shards expired or unreadable; use the whole schema
+        logger.info("Schema narrowed by analysis hints to %s table(s): %s", len(tables), ', '.join(tables))
+        return "\n\n".join(blocks)
+
+    def _sql_prompt_prefix(self, nlq: str, schema_info: str, analysis_hints: Optional[str]) -> str:
+        """
+        Renders the schema-bearing part of the generation/correction prompt. It is the same
+        for every attempt at an NLQ, so it is rendered once and reused by each retry.
+        """
+        return self._load_prompt("sql_prompt_prefix.j2", {
             "nlq": nlq,
             "schema_info": schema_info,
             "analysis_hints": analysis_hints
         })
-        sql_draft = self._run_agent_task(
-            "SQL Generator",
-            prompt,
-            settings.OPENAI_MODEL_GENERATION
-        )
-        if not sql_draft or not sql_draft.upper().startswith("SELECT"):
-            logger.error(f"SQL Generator produced invalid output: {sql_draft}")
-            raise OrchestrationError("SQL Generation failed to produce valid SQL structure.")
-        return sql_draft
 
-    def _validate_sql(self, sql_draft: str, schema_info: str) -> Tuple[bool, Optional[str]]:
+    async def _generate_or_correct(
+        self,
+        prompt_prefix: str,
+        sql_draft: Optional[str] = None,
+        error_message: Optional[str] = None,
+        model_name: Optional[str] = None
+    ) -> str:
+        """
+        Uses SQL Generation Agent, or SQL Correction Agent when a failed `sql_draft` and
+        its `error_message` are given. Only the short suffix differs between the two, so
+        each iteration of the validation loop renders just the draft and error after the
+        shared `prompt_prefix` (see `_sql_prompt_prefix`), in a single LLM round trip.
+        `model_name` overrides the configured model for the task.
+        """
+        if sql_draft:
+            suffix = self._load_prompt("sql_correct_suffix.j2", {
+                "sql_draft": sql_draft,
+                "error_message": error_message
+            })
+        else:
+            suffix = self._load_prompt("sql_generate_suffix.j2", {})
+        prompt = f"{prompt_prefix}\n\n{suffix}"
+        if sql_draft:
+            agent_name, default_model = "SQL Corrector", settings.OPENAI_MODEL_CORRECTION # Powerful model needed
+        else:
+            agent_name, default_model = "SQL Generator", settings.OPENAI_MODEL_GENERATION
+        model_name = model_name or default_model
+        sql = self._normalize_sql(await self._astream_agent_task(agent_name, prompt, model_name))
+        if not sql or not _SELECT_RE.match(sql):
+            logger.error("%s produced invalid output: %s", agent_name, sql)
+            raise OrchestrationError(f"{agent_name} failed to produce valid SQL structure.")
+        return sql
+
+    async def _validate_sql(self, sql_draft: str, schema_info: str) -> Tuple[bool, Optional[str]]:
         """
-        Uses SQL Validation Agent (LLM-based semantic check + Trino execution check).
+        Uses SQL Validation Agent (local parse/table check, then Trino validation check).
         Returns (is_valid, error_message)
         """
         # 1. LLM-based check (optional, faster check)
         # prompt = self._load_prompt("sql_validator.j2", {"sql_draft": sql_draft, "schema_info": schema_info})
-        # validation_result = self._run_agent_task(
+        # validation_result = await self._run_agent_task(
         #     "SQL Validator",
         #     prompt,
         #     settings.OPENAI_MODEL_ANALYSIS # Cheaper model maybe ok for validation
@@ -143,11 +402,18 @@ class MasterOrchestrator:
         #     # Decide if this is a hard fail or just a warning
         #     # return False, f"LLM Validation Failed: {validation_result}"
 
-        # 2. Trino execution check (Syntax check via LIMIT 0 or EXPLAIN)
+        # 2. Local check: malformed SQL or unknown tables fail here, without a Trino round trip
+        local_error = local_sql_error(sql_draft, schema_info)
+        if local_error:
+            logger.warning("Local SQL validation failed: %s", local_error)
+            return False, f"Local Validation Error: {local_error}"
+
+        # 3. Trino execution check (Syntax check via LIMIT 0 or EXPLAIN)
         logger.info("Performing Trino-based SQL validation...")
-        validation_error = self.trino.execute_validation(sql_draft)
+        async with self._trino_semaphore:
+            validation_error = await self.trino.execute_validation_async(sql_draft)
         if validation_error:
-            logger.warning(f"Trino validation failed: {validation_error}")
+            logger.warning("Trino validation failed: %s", validation_error)
             # Format error nicely for the correction agent
             error_msg = f"Trino Validation Error: {type(validation_error).__name__} - {str(validation_error)}"
             return False, error_msg
@@ -156,138 +422,299 @@ class MasterOrchestrator:
             return True, None
 
 
-    def _correct_sql(self, nlq: str, schema_info: str, sql_draft: str, error_message: str) -> str:
-        """Uses SQL Correction Agent."""
-        prompt = self._load_prompt("sql_corrector.j2", {
-            "nlq": nlq,
-            "schema_info": schema_info,
-            "sql_draft": sql_draft,
-            "error_message": error_message
-        })
-        corrected_sql = self._run_agent_task(
-            "SQL Corrector",
-            prompt,
-            settings.OPENAI_MODEL_CORRECTION # Powerful model needed
-        )
-        if not corrected_sql or not corrected_sql.upper().startswith("SELECT"):
-             logger.error(f"SQL Corrector produced invalid output: {corrected_sql}")
-             raise OrchestrationError("SQL Correction failed to produce valid SQL structure.")
-        return corrected_sql
-
-    def _execute_sql(self, final_sql: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    async def _execute_sql(self, final_sql: str) -> Tuple[List[Tuple], List[str], Optional[str]]:
         """
         Uses SQL Execution Agent logic (calls TrinoExecutor).
-        Returns (results, error_message)
+        Fetches at most MAX_RESULT_ROWS + 1 rows, so callers can tell whether the result was truncated.
+        Returns (results, columns, error_message)
         """
-        logger.info(f"Executing final SQL: {final_sql[:100]}...")
-        results, error = self.trino.execute_query(final_sql)
+        logger.info("Executing final SQL: %.100s...", final_sql) # Truncated by the formatter, only if emitted
+        async with self._trino_semaphore:
+            results, columns, error = await self.trino.execute_query_async(final_sql, max_rows=settings.MAX_RESULT_ROWS + 1)
         if error:
-            logger.error(f"Final SQL execution failed: {error}")
+            logger.error("Final SQL execution failed: %s", error)
             error_msg = f"Trino Execution Error: {type(error).__name__} - {str(error)}"
-            return [], error_msg # Return empty list and error message
+            return [], [], error_msg # Return empty lists and error message
         else:
-            logger.info(f"Final SQL execution successful, {len(results)} rows returned.")
-            return results, None
+            logger.info("Final SQL execution successful, %s rows returned.", len(results))
+            return results, columns, None
 
-    def _explain_sql(self, final_sql: str) -> str:
+    async def _explain_sql(self, final_sql: str) -> str:
         """Uses SQL Explanation Agent."""
         prompt = self._load_prompt("sql_explainer.j2", {"final_sql": final_sql})
-        explanation = self._run_agent_task(
+        explanation = await self._run_agent_task(
             "SQL Explainer",
             prompt,
             settings.OPENAI_MODEL_EXPLANATION
         )
         return explanation
 
-    def process_nlq(self, nlq: str) -> Dict[str, Any]:
+    async def _draft_candidates(
+        self,
+        prompt_prefix: str,
+        sql_draft: Optional[str],
+        error_message: Optional[str],
+        width: int
+    ) -> List[str]:
         """
-        Main orchestration flow based on the Mermaid diagram.
-        Returns a dictionary containing results, SQL, explanation, status, etc.
+        Requests `width` SQL drafts concurrently (generation, or correction of `sql_draft`).
+        Failed samples are dropped; raises the first failure only if none succeeded.
         """
-        logger.info(f"Starting orchestration for NLQ: '{nlq}'")
-        output = {
-            "status": "FAILED",
-            "nlq": nlq,
-            "analysis_hints": None,
-            "schema_info": None,
-            "sql_generated": None,
-            "sql_final": None,
-            "validation_error": None,
-            "execution_error": None,
-            "explanation": None,
-            "results": None,
-            "error_message": None,
-        }
-
+        drafts = await asyncio.gather(*(
+            self._generate_or_correct(prompt_prefix, sql_draft, error_message)
+            for _ in range(width)
+        ), return_exceptions=True)
+        candidates = [d for d in drafts if not isinstance(d, BaseException)]
+        if not candidates:
+            raise drafts[0]
+        if len(candidates) < width:
+            logger.warning("%s of %s speculative SQL drafts failed.", width - len(candidates), width)
+        return candidates
+
+    async def _race_generation(self, prompt_prefix: str, schema_info: str) -> Tuple[str, bool, Optional[str]]:
+        """
+        Generates the first draft with every GEN_MODEL_RACE model concurrently, validating
+        each draft as soon as it arrives. The first valid one wins and the other models are
+        cancelled. If none validates, returns (sql, False, error) for the first-listed model
+        that produced a draft, so the correction loop continues from it.
+        """
+        async def generate_and_validate(model: str) -> Tuple[str, str, bool, Optional[str]]:
+            async with self._model_semaphores[model]:
+                sql = await self._generate_or_correct(prompt_prefix, model_name=model)
+            is_valid, error = await self._validate_sql(sql, schema_info)
+            return model, sql, is_valid, error
+
+        tasks = [asyncio.create_task(generate_and_validate(model)) for model in self._race_models]
+        failed: Dict[str, Tuple[str, Optional[str]]] = {}
         try:
-            # 1. Analyze Query (Optional but helpful)
-            # output["analysis_hints"] = self._analyze_query(nlq)
-            # logger.info(f"Analysis hints: {output['analysis_hints']}")
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    model, sql, is_valid, error = await next_done
+                except OrchestrationError as e:
+                    logger.warning("Model race entrant failed: %s", e)
+                    continue
+                if is_valid:
+                    logger.info("Model race won by %s", model)
+                    return sql, True, None
+                failed[model] = (sql, error)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if not failed:
+            raise OrchestrationError("No model in GEN_MODEL_RACE produced SQL.")
+        sql, error = failed[next(model for model in self._race_models if model in failed)]
+        return sql, False, error
+
+    async def _validate_candidates(self, candidates: List[str], schema_info: str) -> Tuple[str, bool, Optional[str]]:
+        """
+        Validates all candidates concurrently (bounded by TRINO_MAX_CONCURRENCY), so this
+        takes the slowest validation rather than their sum, and returns (sql, is_valid, error) for the
+        first valid one, or for the first candidate if none is valid.
+        """
+        results = await asyncio.gather(*(self._validate_sql(sql, schema_info) for sql in candidates))
+        for sql, (is_valid, error) in zip(candidates, results):
+            if is_valid:
+                return sql, True, None
+        return candidates[0], False, results[0][1]
+
+    @staticmethod
+    def _plan_cache_key(nlq: str, schema_info: str) -> str:
+        """
+        Cache key for the SQL and explanation of an NLQ. It combines a hash of the NLQ
+        (whitespace normalized only) with a schema version, so cached SQL is
+        dropped when the schema changes.
+        """
+        schema_version = hashlib.blake2b(schema_info.encode(), digest_size=8).hexdigest()
+        return f"nlq_plan:{nlq_key(nlq)}:{schema_version}"
 
-            # 2. Retrieve Schema
-            output["schema_info"] = self._retrieve_schema() # Pass hints if analyzer used
-            if not output["schema_info"]:
+    async def _prepare_sql(self, nlq: str, output: OrchestrationResult, force_refresh: bool = False) -> Optional[str]:
+        """
+        Runs steps 1-4 of the flow (analysis, schema retrieval, generation and the
+        validation/correction loop), filling `output` in place.
+        SQL that previously validated and ran for the same NLQ and schema is reused from the
+        cache (unless `force_refresh`), skipping every LLM call; newly validated SQL is only
+        cached once it has run (see `record_execution`).
+        Returns the plan cache key (None without a cache).
+        Raises OrchestrationError if no valid SQL could be produced.
+        """
+        # 1. Analyze Query (Optional but helpful) and 2. Retrieve Schema.
+        # The two are independent, so when analysis is enabled they run concurrently;
+        # the analysis is cancelled if the SQL turns out to be cached.
+        analysis_task = asyncio.create_task(self._analyze_query(nlq)) if settings.AGENT_ENABLE_ANALYSIS else None
+        try:
+            output.schema_info = await self._retrieve_schema()
+            if not output.schema_info:
                  raise OrchestrationError("Failed to retrieve a valid schema.")
 
-            # 3. Initial SQL Generation
-            current_sql = self._generate_sql(nlq, output["schema_info"], output["analysis_hints"])
-            output["sql_generated"] = current_sql
-            logger.info(f"Initial SQL generated: {current_sql[:150]}...")
+            plan_key = self._plan_cache_key(nlq, output.schema_info) if self.cache else None
+            prompt_schema = output.schema_info
+            cached_sql = await self.cache.get(f"{plan_key}:sql") if plan_key and not force_refresh else None
+            if isinstance(cached_sql, str):
+                logger.info("Validated SQL retrieved from cache.")
+                output.sql_generated = output.sql_final = self._normalize_sql(cached_sql)
+                return plan_key
+
+            if analysis_task:
+                try:
+                    output.analysis_hints = await analysis_task
+                except OrchestrationError as e:
+                    # Hints are optional: a failed analysis must not abort the request
+                    logger.warning("Query analysis failed, continuing without hints: %s", e)
+                logger.info("Analysis hints: %s", output.analysis_hints)
+                if output.analysis_hints and self.cache:
+                    # Send the LLM only the tables the hints name. Validation and the plan
+                    # cache key stay on the full schema: the hints may miss a table the SQL
+                    # legitimately needs, and the full schema is what versions the cached SQL.
+                    prompt_schema = await self._retrieve_schema(output.analysis_hints)
+        finally:
+            if analysis_task and not analysis_task.done():
+                analysis_task.cancel()
+
+        # 3. SQL Generation and 4. Validation and Correction Loop.
+        # The first pass generates; each later pass corrects the previous draft using its error.
+        # Corrections are sampled SPECULATIVE_N at a time and the first candidate that
+        # validates wins, so a slow or wrong sample doesn't cost a whole serial round.
+        # With GEN_MODEL_RACE set, the first draft is raced across those models instead.
+        prompt_prefix = self._sql_prompt_prefix(nlq, prompt_schema, output.analysis_hints)
+        current_sql, validation_error = None, None
+        for attempt in range(settings.AGENT_MAX_RETRIES + 1):
+            if current_sql is None and self._race_models:
+                current_sql, is_valid, validation_error = await self._race_generation(prompt_prefix, output.schema_info)
+            else:
+                width = settings.SPECULATIVE_N if current_sql else 1
+                candidates = await self._draft_candidates(prompt_prefix, current_sql, validation_error, width)
+                logger.info("SQL drafts (attempt %s/%s): %s", attempt + 1, settings.AGENT_MAX_RETRIES + 1, len(candidates))
+                current_sql, is_valid, validation_error = await self._validate_candidates(candidates, output.schema_info)
+            output.sql_generated = current_sql # Latest attempt
+            output.validation_error = validation_error # Store last validation error
+            if is_valid:
+                logger.info("SQL validation successful.")
+                output.sql_final = current_sql
+                break # Exit loop on success
+            logger.warning("SQL invalid: %s", validation_error)
+        else:
+            logger.error("Max correction retries reached. Failing orchestration.")
+            raise OrchestrationError(f"SQL could not be validated after {settings.AGENT_MAX_RETRIES + 1} attempts. Last error: {validation_error}")
+        return plan_key
 
-            # 4. Validation and Correction Loop
-            is_valid = False
-            for attempt in range(settings.AGENT_MAX_RETRIES + 1):
-                logger.info(f"Validation attempt {attempt + 1}/{settings.AGENT_MAX_RETRIES + 1}")
-                is_valid, validation_error = self._validate_sql(current_sql, output["schema_info"])
-                output["validation_error"] = validation_error # Store last validation error
+    async def record_execution(self, result: OrchestrationResult, succeeded: bool):
+        """
+        Step 7: caches the final SQL of `result` once it has run successfully, or drops the
+        cached SQL and explanation for its NLQ if it failed. EXPLAIN (TYPE VALIDATE) doesn't
+        catch runtime errors (division by zero, bad casts, memory limits), so SQL is only
+        reused after a real execution, and SQL that broke isn't replayed.
+        """
+        if not self.cache or not result.sql_final or not result.schema_info:
+            return
+        plan_key = self._plan_cache_key(result.nlq, result.schema_info)
+        if succeeded:
+            await self.cache.set(f"{plan_key}:sql", result.sql_final, ttl=settings.NLQ_SQL_TTL)
+        else:
+            await self.cache.delete(f"{plan_key}:sql", f"{plan_key}:explanation")
 
-                if is_valid:
-                    logger.info("SQL validation successful.")
-                    output["sql_final"] = current_sql
-                    break # Exit loop on success
-                else:
-                    logger.warning(f"SQL invalid: {validation_error}")
-                    if attempt < settings.AGENT_MAX_RETRIES:
-                        logger.info("Attempting SQL correction...")
-                        current_sql = self._correct_sql(nlq, output["schema_info"], current_sql, validation_error)
-                        logger.info(f"Corrected SQL (attempt {attempt+1}): {current_sql[:150]}...")
-                        output["sql_generated"] = current_sql # Update with the latest attempt
-                    else:
-                        logger.error("Max correction retries reached. Failing orchestration.")
-                        raise OrchestrationError(f"SQL could not be validated after {settings.AGENT_MAX_RETRIES + 1} attempts. Last error: {validation_error}")
-
-            # 5. Execute Final SQL (if valid)
-            if output["sql_final"]:
-                results, execution_error = self._execute_sql(output["sql_final"])
-                output["results"] = results
-                output["execution_error"] = execution_error
+    async def _explain_sql_safely(self, final_sql: str, plan_key: Optional[str] = None, force_refresh: bool = False) -> str:
+        """
+        Step 6: explains the final SQL, reusing a cached explanation under `plan_key` if any.
+        Failures are logged and replaced by a placeholder, never raised (nor cached).
+        """
+        if plan_key and not force_refresh:
+            cached_explanation = await self.cache.get(f"{plan_key}:explanation")
+            if isinstance(cached_explanation, str):
+                logger.info("SQL explanation retrieved from cache.")
+                return cached_explanation
+        try:
+            explanation = await self._explain_sql(final_sql)
+            logger.info("SQL explanation generated.")
+        except Exception as explain_err:
+            logger.warning("Failed to generate SQL explanation: %s", explain_err)
+            return "(Explanation generation failed)"
+        if plan_key:
+            await self.cache.set(f"{plan_key}:explanation", explanation, ttl=settings.NLQ_EXPLANATION_TTL)
+        return explanation
+
+    async def process_nlq(self, nlq: str, force_refresh: bool = False) -> OrchestrationResult:
+        """
+        Main orchestration flow based on the Mermaid diagram.
+        `force_refresh` bypasses the cached SQL and explanation for this NLQ.
+        Returns an OrchestrationResult with results, SQL, explanation, status, etc.
+
+        Concurrent calls for the same NLQ (up to whitespace) are coalesced: the first
+        starts the run and later ones await the same result, which callers must not mutate.
+        """
+        key = (nlq_key(nlq), force_refresh)
+        if key in self._nlq_flights:
+            logger.info("Joining in-flight orchestration for NLQ: '%s'", nlq)
+        return await self._nlq_flights.do(key, lambda: self._process_nlq(nlq, force_refresh))
+
+    async def _process_nlq(self, nlq: str, force_refresh: bool) -> OrchestrationResult:
+        """Runs one orchestration for `process_nlq`."""
+        logger.info("Starting orchestration for NLQ: '%s'", nlq)
+        output = OrchestrationResult(nlq=nlq)
+
+        try:
+            plan_key = await self._prepare_sql(nlq, output, force_refresh)
+
+            # 5. Execute Final SQL (if valid), and 6. Explain SQL (Optional).
+            # The explanation only needs the SQL, so it overlaps with the Trino round trip.
+            if output.sql_final:
+                (results, columns, execution_error), explanation = await asyncio.gather(
+                    self._execute_sql(output.sql_final),
+                    self._explain_sql_safely(output.sql_final, plan_key, force_refresh)
+                )
+                output.results = results[:settings.MAX_RESULT_ROWS]
+                output.columns = columns
+                output.results_truncated = len(results) > settings.MAX_RESULT_ROWS
+                output.execution_error = execution_error
                 if execution_error:
-                    logger.error(f"Execution failed for validated SQL: {execution_error}")
-                    output["error_message"] = f"Execution Failed: {execution_error}"
+                    logger.error("Execution failed for validated SQL: %s", execution_error)
+                    output.error_message = f"Execution Failed: {execution_error}"
                     # Don't set status to SUCCESS if execution fails
                 else:
                     logger.info("SQL executed successfully.")
-                    output["status"] = "SUCCESS"
-
-                    # 6. Explain SQL (Optional)
-                    try:
-                        output["explanation"] = self._explain_sql(output["sql_final"])
-                        logger.info("SQL explanation generated.")
-                    except Exception as explain_err:
-                        logger.warning(f"Failed to generate SQL explanation: {explain_err}")
-                        output["explanation"] = "(Explanation generation failed)"
+                    output.status = "SUCCESS"
+                    output.explanation = explanation
+                await self.record_execution(output, succeeded=not execution_error)
 
             else:
                  # Should be caught by loop exhaustion, but as safeguard:
-                 output["error_message"] = f"SQL validation failed: {output['validation_error']}"
+                 output.error_message = f"SQL validation failed: {output.validation_error}"
+
+
+        except OrchestrationError as e:
+            logger.error("Orchestration failed: %s", e)
+            output.error_message = str(e)
+        except Exception as e:
+            logger.exception("An unexpected error occurred during orchestration: %s", e)
+            output.error_message = f"Unexpected server error: {type(e).__name__}"
+
+        logger.info("Orchestration finished with status: %s", output.status)
+        return output
 
+    async def plan_nlq(self, nlq: str, force_refresh: bool = False) -> OrchestrationResult:
+        """
+        Runs the flow up to and including the explanation, but leaves execution of
+        the final SQL to the caller (used for streaming rows as Trino returns them).
+        Returns the same OrchestrationResult as `process_nlq`, with status "VALIDATED" on success.
+        The caller reports how execution went through `record_execution`.
+        """
+        logger.info("Starting orchestration (plan only) for NLQ: '%s'", nlq)
+        output = OrchestrationResult(nlq=nlq)
+
+        try:
+            plan_key = await self._prepare_sql(nlq, output, force_refresh)
+            if output.sql_final:
+                output.status = "VALIDATED"
+                output.explanation = await self._explain_sql_safely(output.sql_final, plan_key, force_refresh)
+            else:
+                 output.error_message = f"SQL validation failed: {output.validation_error}"
 
         except OrchestrationError as e:
-            logger.error(f"Orchestration failed: {e}")
-            output["error_message"] = str(e)
+            logger.error("Orchestration failed: %s", e)
+            output.error_message = str(e)
         except Exception as e:
-            logger.exception(f"An unexpected error occurred during orchestration: {e}")
-            output["error_message"] = f"Unexpected server error: {type(e).__name__}"
+            logger.exception("An unexpected error occurred during orchestration: %s", e)
+            output.error_message = f"Unexpected server error: {type(e).__name__}"
 
-        logger.info(f"Orchestration finished with status: {output['status']}")
-        return output 
\ No newline at end of file
+        logger.info("Orchestration (plan only) finished with status: %s", output.status)
+        return output
@@ -0,0 +1,29 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent async calls by key: while a call for a key is running, later
+    callers await the same result (or exception) instead of starting their own.
+    Nothing is kept once the call finishes; put a cache in front for that.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Future[T]"] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        """True while a call for `key` is running."""
+        return key in self._inflight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Returns the result of `fn()`, sharing one run with every concurrent caller for `key`."""
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(fn())
+            self._inflight[key] = flight
+            flight.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded, so one caller being cancelled doesn't cancel the run the others await
+        return await asyncio.shield(flight)
@@ -0,0 +1,60 @@
+import re
+from functools import lru_cache
+from typing import FrozenSet, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from src.logging.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Table headers in the schema string built by TrinoExecutor.get_schema_info: "TABLE schema.table ("
+_SCHEMA_TABLE_RE = re.compile(r"^TABLE (?:([^.\s]+)\.)?(\S+) \(", re.MULTILINE)
+
+
+@lru_cache(maxsize=8)
+def schema_tables(schema_info: str) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """Parses (schema names, table names), lowercased, out of a schema string. Cached per schema."""
+    schemas, tables = set(), set()
+    for schema, table in _SCHEMA_TABLE_RE.findall(schema_info):
+        if schema:
+            schemas.add(schema.lower())
+        tables.add(table.lower())
+    return frozenset(schemas), frozenset(tables)
+
+
+def local_sql_error(sql: str, schema_info: str) -> Optional[str]:
+    """
+    Cheap in-process pre-check before sending SQL to Trino: parses it with the Trino
+    dialect and checks that every table it reads from (CTEs aside) is in the schema.
+    Tables qualified with another schema or catalog can't be checked here and are left
+    to Trino. Returns an error message for the correction agent, or None if it passes.
+    """
+    try:
+        statements = sqlglot.parse(sql, read="trino")
+    except SqlglotError as e:
+        return f"SQL Parse Error: {e}"
+
+    known_schemas, known_tables = schema_tables(schema_info)
+    if not known_tables:
+        return None # Nothing to check against
+
+    unknown = set()
+    for statement in statements:
+        if statement is None:
+            continue
+        ctes = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+        for table in statement.find_all(exp.Table):
+            name = table.name.lower()
+            if not name or name in ctes:
+                continue
+            if table.db and table.db.lower() not in known_schemas:
+                continue
+            if name not in known_tables:
+                unknown.add(f"{table.db}.{table.name}" if table.db else table.name) # Not the alias
+
+    if unknown:
+        return f"Unknown table(s): {', '.join(sorted(unknown))}. Use only tables listed in the schema."
+    return None
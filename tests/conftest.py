@@ -0,0 +1,6 @@
+import os
+
+# src.config builds Settings at import time; give the required fields dummy values
+# so modules can be imported without a .env or a running Trino/Redis.
+os.environ.setdefault("TRINO_HOST", "localhost")
+os.environ.setdefault("API_KEY", "test-key")
@@ -0,0 +1,130 @@
+"""
+Static guard against blocking the event loop: no `async def` in src/ may call a sync
+Trino entry point or time.sleep, either directly or through a sync helper defined in
+the same module (one level deep), and no module may use the sync Redis client.
+
+Async code must use the async siblings (e.g. execute_query_async) or hand blocking
+callables to a worker thread (asyncio.to_thread, run_in_threadpool). Calls made
+through deeper helper chains, other modules or dynamic dispatch aren't traced.
+"""
+import ast
+import pathlib
+from typing import Dict, List
+
+import pytest
+
+SRC_DIR = pathlib.Path(__file__).resolve().parent.parent / "src"
+
+_BLOCKING_METHODS = frozenset({
+    "execute_query", "execute_validation", "get_schema_info", "get_schema_tables",
+    "stream_query", "_execute_with_retry", "_do_execute", "_connect", "_connection",
+})
+_BLOCKING_FUNCTIONS = frozenset({("time", "sleep")})
+# Sync client entry points of redis-py; redis.asyncio and redis.exceptions are fine
+_SYNC_REDIS_NAMES = frozenset({"Redis", "StrictRedis", "ConnectionPool", "Sentinel", "from_url"})
+
+
+def _called_name(call: ast.Call):
+    """Returns (owner, attribute) for `owner.attr(...)` calls, (None, name) for `name(...)`."""
+    func = call.func
+    if isinstance(func, ast.Attribute):
+        owner = func.value.id if isinstance(func.value, ast.Name) else None
+        return owner, func.attr
+    if isinstance(func, ast.Name):
+        return None, func.id
+    return None, None
+
+
+def _direct_calls(node: ast.AST):
+    """Yields calls made directly in `node`'s body, skipping nested functions and lambdas."""
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            continue # Sync helpers run in threads; nested coroutines are scanned on their own
+        if isinstance(child, ast.Call):
+            yield child
+        yield from _direct_calls(child)
+
+
+def _blocking_calls(node: ast.AST):
+    """Yields (call, name) for blocking calls made directly in `node`'s body."""
+    for call in _direct_calls(node):
+        owner, name = _called_name(call)
+        if name in _BLOCKING_METHODS or (owner, name) in _BLOCKING_FUNCTIONS:
+            yield call, f"{owner}.{name}" if owner else name
+
+
+def _sync_helpers(tree: ast.Module) -> Dict[str, List[ast.FunctionDef]]:
+    """Sync functions and methods defined in a module, by name."""
+    helpers: Dict[str, List[ast.FunctionDef]] = {}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef)):
+            for child in node.body:
+                if isinstance(child, ast.FunctionDef):
+                    helpers.setdefault(child.name, []).append(child)
+    return helpers
+
+
+def _async_violations(tree: ast.Module):
+    """Yields (lineno, message) for blocking calls reachable from each `async def` in a module."""
+    helpers = _sync_helpers(tree)
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.AsyncFunctionDef):
+            continue
+        for call, name in _blocking_calls(node):
+            yield call.lineno, f"{node.name}() calls {name}()"
+        for call in _direct_calls(node):
+            owner, helper_name = _called_name(call)
+            if owner not in (None, "self", "cls") or helper_name in _BLOCKING_METHODS:
+                continue
+            for helper in helpers.get(helper_name, ()):
+                for _, name in _blocking_calls(helper):
+                    yield call.lineno, f"{node.name}() calls {helper_name}(), which calls {name}()"
+
+
+def _sync_redis_uses(tree: ast.Module):
+    """Yields (lineno, name) for imports or attribute uses of the sync Redis client."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module == "redis":
+            for alias in node.names:
+                if alias.name in _SYNC_REDIS_NAMES:
+                    yield node.lineno, f"redis.{alias.name}"
+        elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "redis":
+            if node.attr in _SYNC_REDIS_NAMES:
+                yield node.lineno, f"redis.{node.attr}"
+
+
+def _source_trees():
+    for path in sorted(SRC_DIR.rglob("*.py")):
+        yield path.relative_to(SRC_DIR.parent), ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+
+
+def test_no_sync_trino_call_reachable_from_async_def():
+    violations = [f"{path}:{lineno} {message}" for path, tree in _source_trees() for lineno, message in _async_violations(tree)]
+    assert not violations, "Blocking calls on the event loop:\n" + "\n".join(violations)
+
+
+def test_no_sync_redis_client():
+    uses = [f"{path}:{lineno} {name}" for path, tree in _source_trees() for lineno, name in _sync_redis_uses(tree)]
+    assert not uses, "Sync Redis client used (use redis.asyncio):\n" + "\n".join(uses)
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("async def f(t):\n    t.execute_query('x')\n", 1),
+    ("async def f(t):\n    await asyncio.to_thread(t.execute_query, 'x')\n", 0),
+    ("async def f(t):\n    def g():\n        t.stream_query('x', 1)\n", 0),
+    ("async def f():\n    time.sleep(1)\n", 1),
+    ("def g(t):\n    t.get_schema_info()\nasync def f(t):\n    g(t)\n", 1), # Through a sync helper
+    ("class C:\n    def g(self):\n        time.sleep(1)\n    async def f(self):\n        self.g()\n", 1),
+    ("def g(t):\n    t.get_schema_info()\nasync def f(t):\n    await asyncio.to_thread(g, t)\n", 0),
+])
+def test_guard_detects_blocking_calls(source, expected):
+    assert len(list(_async_violations(ast.parse(source)))) == expected
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("import redis\nclient = redis.Redis()\n", 1),
+    ("from redis import StrictRedis\n", 1),
+    ("from redis import asyncio as aioredis\nfrom redis.exceptions import RedisError\n", 0),
+])
+def test_guard_detects_sync_redis(source, expected):
+    assert len(list(_sync_redis_uses(ast.parse(source)))) == expected
@@ -0,0 +1,38 @@
+import pytest
+
+from src.caching.cache import intent_signature, nlq_key
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Could you show me the top 5 customers?", "show top 5 customers please"),
+    ("Top  5 Customers", "top 5 customers"),
+    ("show top 5 customers.", "show top 5 customers"),
+    ("Show top 5 customers!", "show top 5 customers..."),
+])
+def test_paraphrases_share_a_signature(a, b):
+    assert intent_signature(a) == intent_signature(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("显示所有客户", "显示所有订单"), # Non-ASCII words must not be dropped
+    ("Customers in München", "Customers in Mänchen"),
+    ("Show US customers", "show customers"),
+    ("customers with names like 'A%'", "customers with names 'A%'"),
+    ("orders with a return", "orders"),
+    ("orders with amount != 5", "orders with amount 5"),
+    ("orders over 1.5", "orders over 15"),
+    ("customers named 'SMITH'", "customers named 'Smith'"), # Literals are case-sensitive in Trino
+])
+def test_distinct_questions_get_distinct_signatures(a, b):
+    assert intent_signature(a) != intent_signature(b)
+
+
+def test_filler_only_nlq_does_not_hash_to_empty():
+    assert intent_signature("please?") != intent_signature("")
+    assert intent_signature("please?") != intent_signature("you?")
+
+
+def test_nlq_key_normalizes_only_whitespace():
+    assert nlq_key("top  5\tcustomers ") == nlq_key("top 5 customers")
+    assert nlq_key("customers named SMITH") != nlq_key("customers named Smith")
+    assert nlq_key("top 5 customers.") != nlq_key("top 5 customers")
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from src.orchestration.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    calls = 0
+
+    async def fn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("k", fn) for _ in range(5)))
+        return flights, results
+
+    flights, results = asyncio.run(main())
+    assert calls == 1
+    assert results == [1] * 5
+    assert "k" not in flights # Released once the run finished
+
+
+def test_distinct_keys_run_separately():
+    async def main():
+        flights = SingleFlight()
+        return await asyncio.gather(flights.do("a", lambda: asyncio.sleep(0, "a")), flights.do("b", lambda: asyncio.sleep(0, "b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+
+
+def test_exception_propagates_to_every_caller_and_releases_key():
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(flights.do("k", fn), flights.do("k", fn), return_exceptions=True)
+        return flights, results
+
+    flights, results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert "k" not in flights
+
+
+def test_cancelled_caller_does_not_cancel_shared_run():
+    async def main():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.do("k", lambda: asyncio.sleep(0.02, "done")))
+        second = asyncio.ensure_future(flights.do("k", lambda: asyncio.sleep(0.02, "other")))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, first
+
+    result, first = asyncio.run(main())
+    assert result == "done"
+    with pytest.raises(asyncio.CancelledError):
+        first.result()
@@ -0,0 +1,46 @@
+import pytest
+
+from src.orchestration.sql_check import local_sql_error, schema_tables
+
+SCHEMA = """TABLE sales.customers (
+  id bigint,
+  name varchar
+);
+
+TABLE sales.orders (
+  id bigint,
+  customer_id bigint
+);"""
+
+
+def test_schema_tables_parses_headers():
+    assert schema_tables(SCHEMA) == (frozenset({"sales"}), frozenset({"customers", "orders"}))
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM customers",
+    "SELECT c.name FROM sales.customers c JOIN orders AS o ON o.customer_id = c.id",
+    "WITH recent AS (SELECT * FROM orders) SELECT * FROM recent", # CTE names aren't tables
+    "SELECT * FROM other_catalog.other_schema.anything", # Left to Trino
+])
+def test_known_tables_pass(sql):
+    assert local_sql_error(sql, SCHEMA) is None
+
+
+def test_parse_error_is_reported():
+    assert local_sql_error("SELECT * FROM customers WHERE (id = 1", SCHEMA).startswith("SQL Parse Error")
+
+
+def test_unknown_table_is_reported_without_alias():
+    error = local_sql_error("SELECT * FROM customers c JOIN purchases AS p ON p.id = c.id", SCHEMA)
+    assert error.startswith("Unknown table(s): purchases.")
+    assert " AS " not in error
+
+
+def test_unknown_table_keeps_its_schema():
+    error = local_sql_error("SELECT * FROM sales.purchases p", SCHEMA)
+    assert error.startswith("Unknown table(s): sales.purchases.")
+
+
+def test_empty_schema_skips_table_check():
+    assert local_sql_error("SELECT * FROM anything", "") is None
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("smol_agent") # agent_manager imports it at module level
+
+from src.orchestration.agent_manager import MasterOrchestrator
+
+
+@pytest.mark.parametrize("buffer", [
+    "SELECT 1;",
+    "SELECT 1;  \n",
+    "```sql\nSELECT 1;\n```",
+    "SELECT 'a;b' FROM t;",
+])
+def test_complete_statements(buffer):
+    assert MasterOrchestrator._sql_complete(buffer)
+
+
+@pytest.mark.parametrize("buffer", [
+    "SELECT 1",
+    "SELECT 'a;", # `;` inside an open string literal
+    "```sql\nSELECT 1;", # Fence still open
+    "SELECT 1; -- trailing",
+])
+def test_incomplete_statements(buffer):
+    assert not MasterOrchestrator._sql_complete(buffer)